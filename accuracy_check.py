@@ -1,123 +1,174 @@
 from datetime import datetime
 import re
-import os
-import logging
+import numpy as np
+import aggregate
+import log_config
+import time
+
+# Bump this whenever a change to the scoring can change the confidence score, it invalidates the result cache
+CHECKER_VERSION = "1"
+
+INVOICE_NUMBER_PATTERN = re.compile(r"^INV-\d*$")
+DATE_FORMAT = "%d %b %Y"
+WEIGHTED_SCORES = {
+    "invoice_num": 10,
+    "date_checks": 20,
+    "total_amount": 50,
+    "tax_percentage": 10,
+    "quantity": 10
+}
+MAX_SCORE = 100
+# Points of every check in the breakdown of score_batch, in the order they are added up
+CHECKS = ("invoice_number", "dates", "total_amount", "tax_percentage", "quantity")
+
+
+class BatchScores:
+    """
+    Confidence scores of a batch of invoices.
+    scores[i] is the rounded confidence score of invoice i, or None if scoring it raised errors[i].
+    checks maps every name in CHECKS to the points each invoice got for that check (out of WEIGHTED_SCORES).
+    """
+    def __init__(self, scores: list, checks: dict, errors: list) -> None:
+        self.scores = scores
+        self.checks = checks
+        self.errors = errors
+
+    def breakdown(self, index: int) -> dict:
+        return {check: float(points[index]) for check, points in self.checks.items()}
+
+
+def _parse_dates(values) -> np.ndarray:
+    # Every distinct date string is parsed once, unparseable dates are NaT
+    parsed = {}
+    dates = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[s]')
+    for i, value in enumerate(values):
+        if not isinstance(value, str):
+            continue
+        if value not in parsed:
+            try:
+                parsed[value] = np.datetime64(datetime.strptime(value, DATE_FORMAT), 's')
+            except ValueError:
+                parsed[value] = np.datetime64('NaT')
+        dates[i] = parsed[value]
+    return dates
+
+def _records(sale_summaries) -> list:
+    # A DataFrame of sale_summary records is turned back into dicts, with its NaN for missing values as None
+    if hasattr(sale_summaries, 'to_dict'):
+        records = sale_summaries.to_dict('records')
+        for record in records:
+            for field, value in record.items():
+                if isinstance(value, float) and value != value:
+                    record[field] = None
+        return records
+    return list(sale_summaries)
+
+def score_batch(sale_summaries, timer=None) -> BatchScores:
+    """
+    Scores a list (or DataFrame) of sale_summary records at once, every check is computed for the whole batch.
+    The scores are the same as scoring every invoice with Crosschecker.
+    Optional timing.StageTimer, the time spent scoring is added to its 'crosscheck' stage.
+    """
+    start = time.perf_counter()
+    sale_summaries = _records(sale_summaries)
+    count = len(sale_summaries)
+    errors = [None] * count
+    checks = {check: np.zeros(count, dtype=np.float64) for check in CHECKS}
+
+    # Invoice Number Pattern Check
+    invoice_numbers = [sale_summary["invoice_number"] for sale_summary in sale_summaries]
+    valid_numbers = np.array([isinstance(number, str) and INVOICE_NUMBER_PATTERN.match(number) is not None
+                              for number in invoice_numbers], dtype=bool)
+    checks["invoice_number"][valid_numbers] = WEIGHTED_SCORES["invoice_num"]
+
+    # Date checks, the due date has to be on or after the invoice date
+    invoice_dates = _parse_dates([sale_summary["invoice_date"] for sale_summary in sale_summaries])
+    due_dates = _parse_dates([sale_summary["due_date"] for sale_summary in sale_summaries])
+    has_invoice_date = ~np.isnat(invoice_dates)
+    has_due_date = ~np.isnat(due_dates)
+    dates = checks["dates"]
+    dates += np.where(has_invoice_date, WEIGHTED_SCORES["date_checks"]*0.45, 0.0)
+    dates += np.where(has_due_date, WEIGHTED_SCORES["date_checks"]*0.45, 0.0)
+    in_order = has_invoice_date & has_due_date
+    in_order[in_order] = due_dates[in_order] >= invoice_dates[in_order]
+    dates += np.where(in_order, WEIGHTED_SCORES["date_checks"]*0.1, 0.0)
+
+    # Total Amount Consistency Check, within Rs.1 since rounding off (Ceil) is done in reality.
+    # Otherwise the points are scaled by the share of item amounts that were read.
+    amounts = aggregate.LineItems(sale_summaries, ["amount"])
+    amount_counts = np.array([len(sale_summary["sale_info"]["amount"]) for sale_summary in sale_summaries])
+    missing_amounts = amount_counts - amounts.present["amount"].sum(axis=1)
+    calculated_totals = amounts.sums("amount")
+    total_amounts = np.array([sale_summary["total_amount"] if isinstance(sale_summary["total_amount"], (int, float))
+                              else np.nan for sale_summary in sale_summaries], dtype=np.float64)
+    has_total = np.array([isinstance(sale_summary["total_amount"], (int, float)) for sale_summary in sale_summaries])
+    matches = has_total & (np.abs(calculated_totals - total_amounts) < 1)
+    for i in np.flatnonzero(missing_amounts):
+        # sum() of the item amounts fails on a missing amount, the invoice cannot be scored
+        try:
+            sum(sale_summaries[i]["sale_info"]["amount"])
+        except TypeError as e:
+            errors[i] = e
+    for i in np.flatnonzero(has_total & ~matches & (amount_counts == 0)):
+        errors[i] = errors[i] or ZeroDivisionError("division by zero")
+    adjustments = np.ones(count)
+    np.divide(missing_amounts, amount_counts, out=adjustments, where=amount_counts > 0)
+    adjustments = np.where(amount_counts > 0, 1 - adjustments, 0.0)
+    checks["total_amount"] = np.where(matches, WEIGHTED_SCORES["total_amount"],
+                                      np.where(has_total, adjustments * WEIGHTED_SCORES["total_amount"], 0.0))
+
+    # Tax Percentage and Quantity Checks, the share of items with a valid value
+    tax_counts, valid_taxes, quantity_counts, valid_quantities = aggregate.item_validity(sale_summaries)
+    item_counts = amounts.item_counts
+    scored = item_counts > 0
+    np.divide(valid_taxes, tax_counts, out=checks["tax_percentage"], where=scored & (tax_counts > 0))
+    checks["tax_percentage"] *= WEIGHTED_SCORES["tax_percentage"]
+    np.divide(valid_quantities, quantity_counts, out=checks["quantity"], where=scored & (quantity_counts > 0))
+    checks["quantity"] *= WEIGHTED_SCORES["quantity"]
+    for i in np.flatnonzero(scored & ((tax_counts == 0) | (quantity_counts == 0))):
+        errors[i] = errors[i] or ZeroDivisionError("division by zero")
+
+    # The points are added up in the order of the checks, so the floating point sums match Crosschecker's
+    score = np.zeros(count, dtype=np.float64)
+    for check in CHECKS:
+        score += checks[check]
+    confidence_scores = score / MAX_SCORE
+    scores = [None if error is not None else round(confidence_score, 4)
+              for confidence_score, error in zip(confidence_scores.tolist(), errors)]
+    if timer is not None:
+        timer.add('crosscheck', time.perf_counter() - start)
+    return BatchScores(scores, checks, errors)
+
 
 class Crosschecker:
-    def __init__(self, sale_summary: dict, file_name: str, verbose: int = 0) -> None:
+    def __init__(self, sale_summary: dict, file_name: str, verbose: int = 0, timer=None) -> None:
         self.sale_summary = sale_summary
+        # Optional timing.StageTimer, the time spent scoring is added to its 'crosscheck' stage
+        self.timer = timer
         self.confidence_score = 0
         self.score = 0
-        self.max_score = 100
+        self.max_score = MAX_SCORE
         self.total_items = len(sale_summary["sale_info"]["items"])
-        self.weighted_scores = {
-            "invoice_num": 10,
-            "date_checks": 20,
-            "total_amount": 50,
-            "tax_percentage": 10,
-            "quantity": 10
-        }
+        self.weighted_scores = WEIGHTED_SCORES
         self.verbose = verbose
-        self.logger = logging.getLogger(file_name+".log")
-
-        log_path = os.path.join("logs", file_name+".log")
-        if not self.logger.hasHandlers():  # Avoid adding multiple handlers if already configured
-            file_handler = logging.FileHandler(log_path, mode='a')
-            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-            self.logger.addHandler(file_handler)
-            self.logger.setLevel(logging.DEBUG)
-        self.logger.propagate = True 
+        self.logger = log_config.get_logger(file_name)
+        # Points of every check, filled in by calculate_confidence_score
+        self.checks = {}
 
-    
-    def log(self, message: str) -> None:
+    def log(self, message: str, *args) -> None:
+        # The message is only formatted if debug logging is on
         if self.verbose:
-            self.logger.debug(message)
+            self.logger.debug(message, *args)
     
     def calculate_confidence_score(self) -> float:
-        invoice_number = self.sale_summary["invoice_number"]
-        self.log(f"Checking invoice number: {invoice_number}")
-        
-        # Invoice Number Pattern Check
-        try:
-            if re.match(r"^INV-\d*$", invoice_number):
-                self.score += self.weighted_scores["invoice_num"]
-                self.log("Invoice number passed pattern check")
-            else:
-                self.log("Invoice number failed pattern check")
-        except TypeError:
-            self.log("Invoice number failed pattern check")
-
-        # Date checks
-        try:
-            invoice_date = datetime.strptime(self.sale_summary["invoice_date"], "%d %b %Y")
-            self.log(f"Parsed invoice date: {invoice_date}")
-        except ValueError:
-            self.log("Failed to parse invoice date")
-        except TypeError:
-            self.log("Failed to parse invoice date")
-
-        try:
-            due_date = datetime.strptime(self.sale_summary["due_date"], "%d %b %Y")
-            self.log(f"Parsed due date: {due_date}")
-        except ValueError:
-            self.log("Failed to parse due date")
-        except TypeError:
-            self.log("Failed to parse due date")
-
-        # Date Logic Check
-        try:
-            if 'invoice_date' in locals():
-                self.score += self.weighted_scores["date_checks"]*0.45
-                self.log("Invoice date check passed")
-            if 'due_date' in locals():
-                self.score += self.weighted_scores["date_checks"]*0.45
-                self.log("Due date check passed")
-            if 'invoice_date' in locals() and 'due_date' in locals() and due_date >= invoice_date:
-                self.score += self.weighted_scores["date_checks"]*0.1
-                self.log("Date logic check passed")
-            else:
-                self.log("Date logic check failed")
-                self.log("Either wrong read or due date is before invoice date!")
-        except TypeError:
-            self.log("Date logic check failed")
-
-        sale_info = self.sale_summary["sale_info"]
-
-        # Total Amount Consistency Check
-        total_amount = self.sale_summary["total_amount"]
-        calculated_total = sum(sale_info["amount"])
-        self.log(f"Calculated total amount: {calculated_total}, expected: {total_amount}")
-        try:
-            if abs(calculated_total - total_amount) < 1: # Rounding off(Ceil) is done in reality, I have taken a diff of Rs.1
-                self.score += self.weighted_scores["total_amount"]
-                self.log("Total amount consistency check passed")
-            else:
-                adjustment = (1 - (sale_info["amount"].count(None) / len(sale_info["amount"])))
-                self.score += adjustment * self.weighted_scores["total_amount"]
-                self.log(f"Total amount consistency check failed, adjusted score: {adjustment}")
-        except TypeError:
-            self.log("Total amount consistency check failed")
-
-        if self.total_items > 0:
-            # Tax Percentage Check
-            tax_percentages = sale_info["tax_percentage"]
-            valid_tax_percentages = [0, 5, 12, 18, 28]
-            valid_tax_counts = 0
-            for tax_per in tax_percentages:
-                if tax_per in valid_tax_percentages:
-                    valid_tax_counts += 1
-            self.score += (valid_tax_counts/len(tax_percentages)) * self.weighted_scores["tax_percentage"]
-            self.log(f"Valid tax percentage count: {valid_tax_counts}")
-
-            # Quantity Check
-            quantities = sale_info["quantity"]
-            valid_quantities = 0
-            for quantity in quantities:
-                if (quantity is not None) and (re.match(r"^\d+\s*[A-Z]*$", quantity)):
-                    valid_quantities += 1
-            self.score += (valid_quantities/len(quantities)) * self.weighted_scores["quantity"]
-            self.log(f"Valid quantity count: {valid_quantities}")
-            
+        # Scores a batch of one invoice
+        batch = score_batch([self.sale_summary], timer=self.timer)
+        if batch.errors[0] is not None:
+            raise batch.errors[0]
+        self.checks = batch.breakdown(0)
+        for check, points in self.checks.items():
+            self.log("%s check: %s points", check, points)
+        self.score = sum(self.checks.values())
         self.confidence_score = self.score / self.max_score
-        self.logger.info(f"Final confidence score: {self.confidence_score}")
-        return round(self.confidence_score, 4)
+        self.logger.info("Final confidence score: %s", self.confidence_score)
+        return batch.scores[0]
@@ -0,0 +1,131 @@
+"""
+Batch aggregation of extracted invoices.
+
+The line items of a batch of sale_summary dicts are gathered once into NumPy columns, from which the
+per-invoice totals and rates of outputs.csv and the item validity counts used by the accuracy check
+are computed for the whole batch at once.
+"""
+import re
+import numpy as np
+import line_items
+
+# Columns of outputs.csv, in order
+OUTPUT_COLUMNS = [
+    'taxable_value', 'sgst_amount', 'cgst_amount', 'igst_amount', 'sgst_rate', 'cgst_rate', 'igst_rate',
+    'tax_amount', 'tax_rate', 'final_amount', 'invoice_number', 'invoice_date',
+]
+SUMMED_COLUMNS = ['taxable_value', 'sgst_amount', 'cgst_amount', 'igst_amount', 'tax_amount']
+VALID_TAX_PERCENTAGES = [0, 5, 12, 18, 28]
+QUANTITY_PATTERN = re.compile(r"^\d+\s*[A-Z]*$")
+
+
+class LineItems:
+    """
+    The line items of a batch of invoices as a (invoices x most items) grid per column.
+    Missing values (None) and the padding of invoices with fewer items are 0.0 in values and False in present.
+    The columns of a line_items.SaleInfo are copied from its array, those of a sale_info dict value by value.
+    """
+    def __init__(self, sale_summaries, columns) -> None:
+        sale_infos = [sale_summary['sale_info'] for sale_summary in sale_summaries]
+        self.item_counts = np.array([len(sale_info['items']) for sale_info in sale_infos], dtype=np.int64)
+        width = max((sale_info.item_count if isinstance(sale_info, line_items.SaleInfo) else len(sale_info[column])
+                     for sale_info in sale_infos for column in columns), default=0)
+        self.values = {}
+        self.present = {}
+        for column in columns:
+            values = np.zeros((len(sale_infos), width), dtype=np.float64)
+            present = np.zeros((len(sale_infos), width), dtype=bool)
+            for row, sale_info in enumerate(sale_infos):
+                if isinstance(sale_info, line_items.SaleInfo):
+                    column_values, column_present = sale_info.floats(column)
+                    values[row, :len(column_values)] = np.frombuffer(column_values, dtype=np.float64)
+                    present[row, :len(column_present)] = np.frombuffer(column_present, dtype=np.uint8)
+                    continue
+                for position, value in enumerate(sale_info[column]):
+                    if value is not None:
+                        values[row, position] = value
+                        present[row, position] = True
+            self.values[column] = values
+            self.present[column] = present
+
+    def sums(self, column: str) -> np.ndarray:
+        # Add the items one position at a time, which is the order sum() adds them in,
+        # so the totals are exactly the same as summing every invoice on its own
+        values = self.values[column]
+        totals = np.zeros(values.shape[0], dtype=np.float64)
+        for position in range(values.shape[1]):
+            totals += values[:, position]
+        return totals
+
+
+def _round(values: np.ndarray):
+    # Python's round() to 2 decimals (np.round can differ in the last digit), NaN becomes None
+    return [None if value != value else round(value, 2) for value in values.tolist()]
+
+def _safe_rate(amounts: np.ndarray, bases: np.ndarray) -> np.ndarray:
+    # amount / base * 100, NaN where the base is zero or missing instead of raising ZeroDivisionError
+    rates = np.full(amounts.shape, np.nan)
+    valid = np.isfinite(bases) & (bases != 0)
+    np.divide(amounts, bases, out=rates, where=valid)
+    np.multiply(rates, 100, out=rates, where=valid)
+    return rates
+
+def invoice_totals(sale_summaries) -> list:
+    """
+    outputs.csv rows of a batch of invoices: the summed taxable value and tax amounts, and the
+    rates from them. A rate is None when the amount it is divided by is 0 or missing.
+    """
+    sale_summaries = list(sale_summaries)
+    if not sale_summaries:
+        return []
+    line_items = LineItems(sale_summaries, SUMMED_COLUMNS)
+
+    sums = {column: line_items.sums(column) for column in SUMMED_COLUMNS}
+    # The rates are computed from the rounded totals, like the totals written to the csv
+    rounded = {column: np.array(_round(values), dtype=np.float64) for column, values in sums.items()}
+    final_amounts = np.array([np.nan if s['total_amount'] is None else s['total_amount'] for s in sale_summaries],
+                             dtype=np.float64)
+    rates = {
+        'sgst_rate': _safe_rate(rounded['sgst_amount'], rounded['taxable_value']),
+        'cgst_rate': _safe_rate(rounded['cgst_amount'], rounded['taxable_value']),
+        'igst_rate': _safe_rate(rounded['igst_amount'], rounded['taxable_value']),
+        'tax_rate': _safe_rate(rounded['tax_amount'], final_amounts),
+    }
+
+    columns = {column: rounded[column].tolist() for column in SUMMED_COLUMNS}
+    columns.update({column: _round(values) for column, values in rates.items()})
+    rows = []
+    for i, sale_summary in enumerate(sale_summaries):
+        row = {column: columns[column][i] for column in OUTPUT_COLUMNS if column in columns}
+        row['final_amount'] = sale_summary['total_amount']
+        row['invoice_number'] = sale_summary['invoice_number']
+        row['invoice_date'] = sale_summary['invoice_date']
+        rows.append({column: row[column] for column in OUTPUT_COLUMNS})
+    return rows
+
+def item_validity(sale_summaries):
+    """
+    Per invoice: the number of tax percentages and how many of them are valid, and the number of quantities
+    and how many of them are valid. Returns four integer arrays.
+    """
+    sale_infos = [sale_summary['sale_info'] for sale_summary in sale_summaries]
+    tax_counts = np.array([len(sale_info['tax_percentage']) for sale_info in sale_infos], dtype=np.int64)
+    quantity_counts = np.array([len(sale_info['quantity']) for sale_info in sale_infos], dtype=np.int64)
+    # Flat item columns, reduceat then adds up the flags of every invoice (exact for integers)
+    tax_percentages = [tax for sale_info in sale_infos for tax in sale_info['tax_percentage']]
+    quantities = [quantity for sale_info in sale_infos for quantity in sale_info['quantity']]
+    valid_tax = np.isin(np.array([np.nan if tax is None else tax for tax in tax_percentages], dtype=np.float64),
+                        VALID_TAX_PERCENTAGES)
+    valid_quantity = np.array([quantity is not None and QUANTITY_PATTERN.match(quantity) is not None
+                               for quantity in quantities], dtype=bool)
+    return (tax_counts, _per_invoice(valid_tax, tax_counts),
+            quantity_counts, _per_invoice(valid_quantity, quantity_counts))
+
+def _per_invoice(flags: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    # Number of set flags in every segment of a flat column, counts are the segment lengths
+    totals = np.zeros(len(counts), dtype=np.int64)
+    non_empty = counts > 0
+    if flags.size:
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        totals[non_empty] = np.add.reduceat(flags.astype(np.int64), starts[non_empty])
+    return totals
@@ -0,0 +1,107 @@
+"""
+Micro-benchmark of the item line parser in extract.py.
+
+Compares parse_item_line with the previous implementation, which ran a fresh
+re.search per column and rebuilt the line with re.sub after every column.
+The item lines are taken from the PDFs in the input directory.
+
+Usage:
+    python3 benchmarks/bench_item_parser.py --input-dir "Jan to Mar"
+"""
+import argparse
+import re
+import sys
+import timeit
+from pathlib import Path
+
+import PyPDF2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import extract
+
+
+def legacy_extract_item_details(match, cleaned_matches, i):
+    if match is not None:
+        value = match.group(1)
+        cleaned_matches[i] = re.sub(rf"{re.escape(value)}(?=$)", "", cleaned_matches[i], count=1).strip()
+        return value
+    return None
+
+
+def legacy_parse_item_line(line):
+    # The per item code of Extracter.extract before the compiled parser
+    cleaned_matches = [line]
+    i = 0
+    match = re.search(r"(\d{1,3}(?:,\d{2,3})*\.\d{2})(?=$)", cleaned_matches[i])
+    Amount = legacy_extract_item_details(match, cleaned_matches, i)
+
+    match = re.search(r"(?<=\.\d{2})(\d{1,3}(?:,\d{2,3})*\.\d{2}\s\(\d{1,2}%\))(?=$)", cleaned_matches[i])
+    Tax_amount = legacy_extract_item_details(match, cleaned_matches, i)
+    match = re.search(r"\((\d{1,2}%)\)(?=$)", Tax_amount)
+    Tax_percentage = extract.convert_to_float(match.group(1).replace("%", ""))
+    Tax_amount = re.search(r"(\d{1,3}(?:,\d{2,3})*\.\d{2})", Tax_amount).group(1)
+
+    match = re.search(r"(?<=\w)(\d{1,3}(?:,\d{2,3})*\.\d{2})(?=$)", cleaned_matches[i])
+    Taxable_value = legacy_extract_item_details(match, cleaned_matches, i)
+
+    match = re.search(r"(\d+|\d+\s[A-Z]+)(?=$)", cleaned_matches[i])
+    Quantity = legacy_extract_item_details(match, cleaned_matches, i)
+
+    match = re.search(r"(\(-\d{1,2}%\)|\(-\d{1,2}\.\d{1,2}%\))(?=$)", cleaned_matches[i])
+    Discount = legacy_extract_item_details(match, cleaned_matches, i)
+    Discount = Discount.strip('()') if Discount is not None else None
+
+    match = re.search(r"(\d{1,3}(?:,\d{2,3})*\.\d{2})(?=$)", cleaned_matches[i])
+    Cost_price = legacy_extract_item_details(match, cleaned_matches, i)
+
+    match = re.search(r"(\d{1,3}(?:,\d{2,3})*\.\d{2})(?=$)", cleaned_matches[i])
+    Rate = legacy_extract_item_details(match, cleaned_matches, i)
+    if Rate is None:
+        Rate = Cost_price
+
+    return cleaned_matches[i], Rate, Cost_price, Discount, Quantity, Taxable_value, Tax_amount, Tax_percentage, Amount
+
+
+def load_item_lines(input_dir: Path):
+    lines = []
+    for file_path in sorted(input_dir.glob('*.pdf')):
+        page_text = PyPDF2.PdfReader(str(file_path)).pages[0].extract_text()
+        items = extract.ITEMS_PATTERN.search(page_text)
+        if not items:
+            continue
+        matches = extract.ITEM_SPLIT_PATTERN.findall(items.group(1).strip())
+        lines.extend(extract.NEWLINES_PATTERN.sub(' ', match)[1:].strip() for match in matches)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the item line parser.")
+    parser.add_argument('--input-dir', type=str, default='Jan to Mar', help='Directory of input PDF files.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timing runs, the best one is reported.')
+    parser.add_argument('--number', type=int, default=200, help='Passes over all the item lines per timing run.')
+    args = parser.parse_args()
+
+    lines = load_item_lines(Path(args.input_dir))
+    if not lines:
+        print(f"No item lines found in {args.input_dir}")
+        sys.exit(1)
+
+    # Both parsers must agree before their timings mean anything
+    for line in lines:
+        if legacy_parse_item_line(line) != extract.parse_item_line(line):
+            print(f"Parsers disagree on: {line!r}")
+            sys.exit(1)
+
+    results = {}
+    for name, parse in (('legacy', legacy_parse_item_line), ('compiled', extract.parse_item_line)):
+        best = min(timeit.repeat(lambda: [parse(line) for line in lines], repeat=args.repeat, number=args.number))
+        results[name] = best / (args.number * len(lines)) * 1e6
+
+    print(f"Item lines: {len(lines)}")
+    for name, per_item in results.items():
+        print(f"{name:>8}: {per_item:.2f} us per item")
+    print(f" speedup: {results['legacy'] / results['compiled']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
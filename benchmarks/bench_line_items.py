@@ -0,0 +1,85 @@
+"""
+Memory benchmark of the line items of a batch of invoices.
+
+Extracts --count synthetic invoices (see synthetic_invoices.py) and measures with tracemalloc the memory
+held by their sale_info in two forms:
+  - compact: the line_items.SaleInfo the extracter returns
+  - dict:    the former sale_info dict of 15 lists of boxed floats, strings and Nones, with the tax
+             percentages shared by the rate lists as the extracter used to build it
+and the size of each form once pickled, which is what a worker process sends back for every invoice.
+
+Usage:
+    python3 benchmarks/bench_line_items.py --count 2000 --max-items 30
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import extract
+from bench_throughput import prepare_data
+
+PROJECTED_INVOICES = 100000
+
+
+def dict_form(sale_info) -> dict:
+    # The sale_info dict as the extracter built it before SaleInfo
+    columns = sale_info.to_dict()
+    for column in ('sgst_rate', 'cgst_rate', 'igst_rate'):
+        if columns[column] and columns[column][0] is not None:
+            columns[column] = list(columns['tax_percentage'])
+    if sale_info.has_igst:
+        columns['igst_amount'] = list(columns['tax_amount'])
+    return columns
+
+def held_bytes(make_copies) -> tuple:
+    # Bytes still allocated once make_copies has returned, i.e. held by the copies it returns
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    copies = make_copies()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return held, copies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the memory held by compact and dict line items.")
+    parser.add_argument('--count', type=int, default=2000, help='Number of synthetic invoices.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generator.')
+    parser.add_argument('--max-items', type=int, default=30, help='Most items on an invoice.')
+    parser.add_argument('--data-dir', type=str, default='synthetic', help='Directory of the synthetic invoices.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes used for the extraction.')
+    args = parser.parse_args()
+
+    generator_options = {'count': args.count, 'seed': args.seed, 'igst_share': 0.3, 'scanned_share': 0.0, 'max_items': args.max_items}
+    pdf_paths = prepare_data(Path(args.data_dir), generator_options)
+
+    start = time.perf_counter()
+    sale_infos = []
+    for path, sale_summary, accuracy, error in extract.iter_extract(pdf_paths, workers=args.workers):
+        if error is None:
+            sale_infos.append(sale_summary['sale_info'])
+    items = sum(sale_info.item_count for sale_info in sale_infos)
+    print(f"Extracted {len(sale_infos)} invoices with {items} items in {time.perf_counter() - start:.1f}s")
+
+    # Unpickled copies own all their objects, like the results received from the workers
+    compact_pickles = [pickle.dumps(sale_info) for sale_info in sale_infos]
+    dict_pickles = [pickle.dumps(dict_form(sale_info)) for sale_info in sale_infos]
+    compact_bytes, _ = held_bytes(lambda: [pickle.loads(data) for data in compact_pickles])
+    dict_bytes, _ = held_bytes(lambda: [pickle.loads(data) for data in dict_pickles])
+
+    print(f"{'':>8} {'held MB':>10} {'per invoice':>12} {'per item':>9} {'pickled':>9} {'at ' + format(PROJECTED_INVOICES, ','):>11}")
+    for name, held, pickles in (('dict', dict_bytes, dict_pickles), ('compact', compact_bytes, compact_pickles)):
+        pickled = sum(len(data) for data in pickles)
+        print(f"{name:>8} {held / 2**20:>10.1f} {held / len(sale_infos):>10.0f} B {held / items:>7.0f} B "
+              f"{pickled / len(sale_infos):>7.0f} B {held / len(sale_infos) * PROJECTED_INVOICES / 2**30:>8.2f} GB")
+    print(f"The compact form holds {dict_bytes / compact_bytes:.1f}x less memory")
+
+
+if __name__ == '__main__':
+    main()
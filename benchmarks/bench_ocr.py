@@ -0,0 +1,132 @@
+"""
+Benchmark of the OCR path.
+
+Runs OCR on every page of the PDFs in the input directory, whether they have a
+text layer or not, with:
+  - legacy:   convert_from_path at the default dpi, cv2 grayscale + threshold
+              on every page and pytesseract.image_to_string, as useOCR did before ocr.py
+  - pipeline: extract.process_file with every page OCR'd by ocr.py in page mode, one page at a time rendered
+              to grayscale and piped to tesseract
+  - regions:  the same in region mode, only the fields read by Extracter.extract are OCR'd
+Every mode runs in its own child process so that its peak RSS (including the
+pdftoppm and tesseract subprocesses) can be reported.
+The pipeline and regions modes also report the accuracy of the extracted invoices and the number of files
+whose header fields, total and item count are the same as when read from the text layer. Region mode is
+only offered by main.py (--ocr-mode) once it matches page mode here.
+
+Needs pdftoppm (poppler) and tesseract on the PATH.
+
+Usage:
+    python3 benchmarks/bench_ocr.py --input-dir "Jan to Mar" --limit 10 --ocr-workers 4
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import extract
+import ocr
+
+# Compared with the invoice read from the text layer
+COMPARED_FIELDS = ('invoice_number', 'invoice_date', 'due_date', 'gstin', 'place_of_supply', 'total_amount')
+
+
+def legacy_ocr(pdf_path) -> str:
+    import cv2
+    import numpy as np
+    import pytesseract
+    from PIL import Image
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(pdf_path)
+    preprocessed_images = []
+    for image in images:
+        gray = cv2.cvtColor(np.array(image), cv2.COLOR_BGR2GRAY)
+        _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
+        preprocessed_images.append(Image.fromarray(thresh))
+    extracted_text = ""
+    for image in preprocessed_images:
+        extracted_text += pytesseract.image_to_string(image) + "\n"
+    return extracted_text
+
+
+def invoice_fields(sale_summary) -> list:
+    if sale_summary is None:
+        return None
+    return [sale_summary[field] for field in COMPARED_FIELDS] + [len(sale_summary['sale_info']['items'])]
+
+
+def run_mode(mode: str, pdf_paths, dpi: int, ocr_workers: int) -> dict:
+    ocr_mode = 'regions' if mode == 'regions' else 'page'
+    # Every page is OCR'd, whether it has a text layer or not
+    extract.classify_page = lambda page: 'scanned'
+    extracter_options = {'ocr_dpi': dpi, 'ocr_workers': ocr_workers, 'ocr_mode': ocr_mode}
+    start = time.perf_counter()
+    accuracies = []
+    fields = []
+    for pdf_path in pdf_paths:
+        if mode == 'legacy':
+            legacy_ocr(str(pdf_path))
+        else:
+            sale_summary, accuracy, _, _ = extract.process_file(pdf_path, extracter_options=extracter_options)
+            accuracies.append(accuracy or 0.0)
+            fields.append(invoice_fields(sale_summary))
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {
+        'mode': mode,
+        'files': len(pdf_paths),
+        'seconds': round(elapsed, 3),
+        'seconds_per_file': round(elapsed / max(len(pdf_paths), 1), 3),
+        'peak_rss_mb': round(self_rss / 1024, 1),
+        'peak_child_rss_mb': round(children_rss / 1024, 1),
+        'accuracies': accuracies,
+        'fields': fields,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OCR path.")
+    parser.add_argument('--input-dir', type=str, default='Jan to Mar', help='Directory of input PDF files.')
+    parser.add_argument('--limit', type=int, default=10, help='Number of PDFs to OCR.')
+    parser.add_argument('--dpi', type=int, default=ocr.DEFAULT_DPI, help='Resolution of the pipeline and regions modes.')
+    parser.add_argument('--ocr-workers', type=int, default=4, help='Pages OCR\'d at the same time in the pipeline and regions modes.')
+    parser.add_argument('--mode', choices=['legacy', 'pipeline', 'regions'], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    pdf_paths = sorted(Path(args.input_dir).glob('*.pdf'))[:args.limit]
+    if not pdf_paths:
+        print(f"No PDFs found in {args.input_dir}")
+        sys.exit(1)
+
+    # Child process, run one mode and print its result
+    if args.mode is not None:
+        print(json.dumps(run_mode(args.mode, pdf_paths, args.dpi, args.ocr_workers)))
+        return
+
+    # The same files read from their text layer
+    text_layer_fields = [invoice_fields(extract.process_file(pdf_path)[0]) for pdf_path in pdf_paths]
+
+    for mode in ('legacy', 'pipeline', 'regions'):
+        command = [sys.executable, __file__, '--mode', mode, '--input-dir', args.input_dir, '--limit', str(args.limit),
+                   '--dpi', str(args.dpi), '--ocr-workers', str(args.ocr_workers)]
+        result = json.loads(subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout)
+        line = (f"{mode:>8}: {result['seconds']}s ({result['seconds_per_file']}s per file), "
+                f"peak RSS {result['peak_rss_mb']} MB, peak subprocess RSS {result['peak_child_rss_mb']} MB")
+        if result['accuracies']:
+            accuracies = result['accuracies']
+            matching = sum(fields is not None and fields == expected for fields, expected in zip(result['fields'], text_layer_fields))
+            line += (f", mean accuracy {sum(accuracies) / len(accuracies):.1f}%, {sum(a >= 90 for a in accuracies)} files >= 90%, "
+                     f"{matching}/{len(pdf_paths)} files as read from the text layer")
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Startup benchmark.
+
+Starts a fresh interpreter --repeat times and measures in each:
+  - import:       the time to import main (and with it extract, accuracy_check, ocr...)
+  - first_result: the time from the start of the imports to the sale_summary and accuracy of the
+                  first PDF in the input directory, without the result cache
+  - process:      the wall-clock time of the whole child process, interpreter start included
+and which of the heavy optional modules (pandas, cv2, pytesseract, pyarrow...) were loaded on the way.
+For PDFs with a text layer none of them should be.
+
+Usage:
+    python3 benchmarks/bench_startup.py --input-dir "Jan to Mar" --repeat 10
+    python3 benchmarks/bench_startup.py --json --max-import-ms 300   # exits with 1 above the limit, for CI
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ('pandas', 'cv2', 'pytesseract', 'pdf2image', 'PIL', 'pyarrow')
+
+
+def run_child(pdf_path: Path) -> dict:
+    # Runs in the fresh interpreter, the repo imports are timed so they happen here and not at the top
+    start = time.perf_counter()
+    sys.path.insert(0, str(REPO_DIR))
+    import main
+    import extract
+    imported = time.perf_counter()
+    sale_summary, accuracy, error_message, _ = extract.process_file(pdf_path)
+    finished = time.perf_counter()
+    if error_message is not None:
+        raise RuntimeError(error_message)
+    return {
+        'import_ms': (imported - start) * 1000,
+        'first_result_ms': (finished - start) * 1000,
+        'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the import time and the time to the first result.")
+    parser.add_argument('--input-dir', type=str, default='Jan to Mar', help='Directory of input PDF files.')
+    parser.add_argument('--repeat', type=int, default=10, help='Number of fresh interpreters to start.')
+    parser.add_argument('--json', action='store_true', help='Print the medians as json.')
+    parser.add_argument('--max-import-ms', type=float, default=None, help='Exit with 1 if the median import time is above this.')
+    parser.add_argument('--child', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process, measure once and print the result
+    if args.child is not None:
+        print(json.dumps(run_child(Path(args.child))))
+        return
+
+    pdf_paths = sorted(Path(args.input_dir).glob('*.pdf'))
+    if not pdf_paths:
+        print(f"No PDFs found in {args.input_dir}")
+        sys.exit(1)
+
+    runs = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, __file__, '--child', str(pdf_paths[0].resolve())],
+                                stdout=subprocess.PIPE, check=True).stdout
+        result = json.loads(output)
+        result['process_ms'] = (time.perf_counter() - start) * 1000
+        runs.append(result)
+
+    summary = {
+        'runs': len(runs),
+        'file': pdf_paths[0].name,
+        'import_ms': round(statistics.median(run['import_ms'] for run in runs), 1),
+        'first_result_ms': round(statistics.median(run['first_result_ms'] for run in runs), 1),
+        'process_ms': round(statistics.median(run['process_ms'] for run in runs), 1),
+        'heavy_modules': sorted({name for run in runs for name in run['heavy_modules']}),
+    }
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print(f"Median of {summary['runs']} runs on {summary['file']}:")
+        print(f"  import:       {summary['import_ms']} ms")
+        print(f"  first result: {summary['first_result_ms']} ms")
+        print(f"  process:      {summary['process_ms']} ms")
+        print(f"  heavy modules loaded: {', '.join(summary['heavy_modules']) or 'none'}")
+
+    if args.max_import_ms is not None and summary['import_ms'] > args.max_import_ms:
+        print(f"Median import time {summary['import_ms']} ms is above {args.max_import_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
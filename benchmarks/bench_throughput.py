@@ -0,0 +1,153 @@
+"""
+Throughput benchmark on synthetic invoices.
+
+Generates --count invoices with synthetic_invoices.py (once, they are reused while the generator
+arguments stay the same) and extracts them all with extract.iter_extract:
+  - serial:   in the benchmark process itself
+  - parallel: with --workers worker processes
+Every mode runs in its own child process and reports files/sec, the p50/p95/max latency of every
+stage, the peak RSS of the process and of its largest worker, and how many invoices came out with
+the invoice number, total and item count of truth.jsonl.
+The results are written to --output as json, together with the commit and the machine, so that runs
+can be compared across commits. Nothing is downloaded and the result cache is not used.
+
+Usage:
+    python3 benchmarks/bench_throughput.py --count 1000 --workers 4 --output bench-results.json
+    python3 benchmarks/bench_throughput.py --count 100000 --data-dir /tmp/synthetic --modes parallel
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import synthetic_invoices
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def prepare_data(data_dir: Path, generator_options: dict) -> list:
+    # Reuse the invoices of an earlier run if they were generated with the same options
+    options_path = data_dir / 'generator.json'
+    if options_path.exists() and json.loads(options_path.read_text()) == generator_options:
+        return sorted(data_dir.glob('*.pdf'))
+    for pdf_path in data_dir.glob('*.pdf'):
+        pdf_path.unlink()
+    start = time.perf_counter()
+    paths = synthetic_invoices.generate(data_dir, **generator_options)
+    options_path.write_text(json.dumps(generator_options))
+    print(f"Generated {len(paths)} invoices in {time.perf_counter() - start:.1f}s")
+    return sorted(paths)
+
+def run_mode(data_dir: Path, workers: int) -> dict:
+    # Runs in the child process
+    import extract
+    import timing
+
+    truth = {}
+    with open(data_dir / 'truth.jsonl') as f:
+        for line in f:
+            record = json.loads(line)
+            truth[record['file']] = record
+    pdf_paths = sorted(data_dir.glob('*.pdf'))
+
+    per_file_stages = []
+    counts = {'files': 0, 'errors': 0, 'low_accuracy': 0, 'correct': 0}
+    start = time.perf_counter()
+    for path, sale_summary, accuracy, error, stats in extract.iter_extract(pdf_paths, workers=workers, with_stats=True):
+        counts['files'] += 1
+        per_file_stages.append(stats['stages'])
+        if error is not None:
+            counts['errors'] += 1
+            continue
+        if accuracy < 90:
+            counts['low_accuracy'] += 1
+        expected = truth[Path(path).name]
+        if (sale_summary['invoice_number'] == expected['invoice_number'] and sale_summary['total_amount'] == expected['total_amount']
+                and len(sale_summary['sale_info']['items']) == expected['items']):
+            counts['correct'] += 1
+    elapsed = time.perf_counter() - start
+
+    stages = {
+        stage: {
+            'files': summary['files'],
+            'p50_ms': round(summary['p50'] * 1000, 3),
+            'p95_ms': round(summary['p95'] * 1000, 3),
+            'max_ms': round(summary['max'] * 1000, 3),
+        }
+        for stage, summary in timing.summarize(per_file_stages).items()
+    }
+    # ru_maxrss is in kilobytes on Linux, for the children it is the largest worker
+    return {
+        'workers': workers,
+        **counts,
+        'seconds': round(elapsed, 3),
+        'files_per_second': round(counts['files'] / elapsed, 2) if elapsed else None,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_worker_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'stages': stages,
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              check=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the extraction throughput on synthetic invoices.")
+    parser.add_argument('--count', type=int, default=1000, help='Number of synthetic invoices.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generator.')
+    parser.add_argument('--igst-share', type=float, default=0.3, help='Share of IGST invoices.')
+    parser.add_argument('--scanned-share', type=float, default=0.0, help='Share of rasterized invoices (OCR needs pdftoppm and tesseract).')
+    parser.add_argument('--max-items', type=int, default=12, help='Most items on an invoice.')
+    parser.add_argument('--data-dir', type=str, default='synthetic', help='Directory of the synthetic invoices.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes of the parallel mode.')
+    parser.add_argument('--modes', nargs='+', choices=['serial', 'parallel'], default=['serial', 'parallel'], help='Modes to run.')
+    parser.add_argument('--output', type=str, default='bench-results.json', help='Json file the results are written to.')
+    parser.add_argument('--child-workers', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    data_dir = Path(args.data_dir)
+
+    # Child process, run one mode and print its result
+    if args.child_workers is not None:
+        print(json.dumps(run_mode(data_dir, args.child_workers)))
+        return
+
+    generator_options = {'count': args.count, 'seed': args.seed, 'igst_share': args.igst_share,
+                         'scanned_share': args.scanned_share, 'max_items': args.max_items}
+    prepare_data(data_dir, generator_options)
+
+    results = {
+        'commit': git_commit(),
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'generator': generator_options,
+        'modes': {},
+    }
+    for mode in args.modes:
+        workers = 1 if mode == 'serial' else args.workers
+        command = [sys.executable, __file__, '--data-dir', str(data_dir), '--child-workers', str(workers)]
+        result = json.loads(subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout)
+        results['modes'][mode] = result
+        print(f"{mode:>8}: {result['files']} files in {result['seconds']}s, {result['files_per_second']} files/s, "
+              f"{result['correct']} correct, {result['errors']} errors, peak RSS {result['peak_rss_mb']} MB "
+              f"(largest worker {result['peak_worker_rss_mb']} MB)")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
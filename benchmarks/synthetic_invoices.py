@@ -0,0 +1,267 @@
+"""
+Synthetic invoice generator.
+
+Writes PDFs in the layout Extracter.extract parses (the one of the invoices in "Jan to Mar"), with a mix of
+item counts, discounted and plain items, IGST and SGST/CGST invoices, and text layer and rasterized (scanned) pages.
+Invoices with more items than fit on a page run over several pages, like long supplier invoices.
+The PDFs are written directly, no PDF library or network access is needed; rasterized pages need Pillow.
+The invoice numbers, totals and item counts are written to truth.jsonl next to the PDFs.
+
+The output only depends on the arguments, the same seed always gives the same files.
+
+Usage:
+    python3 benchmarks/synthetic_invoices.py --output-dir synthetic --count 1000 --seed 1 --scanned-share 0.1
+"""
+import argparse
+import json
+import random
+import zlib
+from datetime import date, timedelta
+from pathlib import Path
+
+# A4 in points, the text is set at 9 pt with 12 pt between lines
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 40
+FONT_SIZE = 9
+LEADING = 12
+PAGE_LINES = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+# Rasterized pages are rendered at this resolution
+SCAN_DPI = 150
+
+# Helvetica has no rupee sign, the byte below is mapped to it by the ToUnicode map of the font
+RUPEE_CODE = b"\x80"
+TO_UNICODE_CMAP = (b"/CIDInit /ProcSet findresource begin 12 dict begin begincmap /CMapName /SyntheticRupee def "
+                   b"1 begincodespacerange <00> <FF> endcodespacerange 1 beginbfchar <80> <20B9> endbfchar "
+                   b"endcmap CMapName currentdict /CMap defineresource pop end end")
+
+TAX_PERCENTAGES = (0, 5, 12, 18, 28)
+DISCOUNTS = (5, 10, 12, 15, 20, 25)
+UNITS = ('UNT', 'BTL', 'BOX', 'PAC', 'TUB', 'STRP', 'NOS', 'KG')
+PRODUCTS = ('Face Wash Gel', 'Sunscreen Lotion', 'Moisturising Cream', 'Anti Dandruff Shampoo', 'Hair Serum',
+            'Vitamin C Serum', 'Lip Balm', 'Body Lotion', 'Acne Spot Gel', 'Cleansing Bar', 'Night Cream',
+            'Foot Care Cream', 'Hand Sanitizer', 'Aloe Vera Gel', 'Micellar Water', 'Eye Gel')
+BRANDS = ('Acnesol', 'Dermaq', 'Ahaglow', 'Cetaphil', 'Biluma', 'Sebamed', 'Kozicare', 'Episoft', 'Suncros', 'Venusia')
+SIZES = ('- 15 gm', '- 30 ml', '- 50 gm', '- 100 ml', '- 200 ml', '- 75 gm', '')
+SERVICES = ('Dermatologist Consultation', 'Skin Analysis', 'Follow Up Consultation')
+CUSTOMERS = ('Agrani Kandele', 'Kasturi Kalwar', 'Prashant', 'Divya Suhane', 'Sheetal Kapur', 'Naman', 'Indraja Mohite',
+             'Rishabh Ramola', 'Urmila Jangam', 'Jitesh Soni', 'Akhil Abhay', 'Shefali')
+STATES = ('23-MADHYA PRADESH', '27-MAHARASHTRA', '29-KARNATAKA', '07-DELHI', '24-GUJARAT', '09-UTTAR PRADESH')
+HOME_STATE = '23-MADHYA PRADESH'
+
+
+def money(value: float) -> str:
+    return f"{value:,.2f}"
+
+def make_invoice(rng: random.Random, number: int, igst_share: float, max_items: int) -> dict:
+    # The values of one invoice, rounded like a billing system would
+    invoice_date = date(2024, 1, 1) + timedelta(days=rng.randrange(90))
+    due_date = invoice_date + timedelta(days=rng.choice((0, 0, 7, 15, 30)))
+    igst = rng.random() < igst_share
+    items = []
+    for _ in range(rng.randint(1, max_items)):
+        if rng.random() < 0.1:
+            name = rng.choice(SERVICES)
+            unit = ''
+        else:
+            name = f"{rng.choice(BRANDS)} {rng.choice(PRODUCTS)} {rng.choice(SIZES)}".strip()
+            unit = rng.choice(UNITS)
+        discount = rng.choice(DISCOUNTS) if rng.random() < 0.6 else None
+        cost_price = round(rng.uniform(50, 1500), 2)
+        rate = round(cost_price * (100 - discount) / 100, 2) if discount else cost_price
+        quantity = rng.choice((1, 1, 1, 2, 2, 3, 5))
+        tax_percentage = rng.choice(TAX_PERCENTAGES)
+        taxable_value = round(rate * quantity, 2)
+        tax_amount = round(taxable_value * tax_percentage / 100, 2)
+        items.append({
+            'name': name, 'unit': unit, 'discount': discount, 'cost_price': cost_price, 'rate': rate,
+            'quantity': quantity, 'tax_percentage': tax_percentage, 'taxable_value': taxable_value,
+            'tax_amount': tax_amount, 'amount': round(taxable_value + tax_amount, 2),
+        })
+    amount = round(sum(item['amount'] for item in items), 2)
+    return {
+        'invoice_number': f"INV-{number}",
+        'invoice_date': invoice_date.strftime("%d %b %Y"),
+        'due_date': due_date.strftime("%d %b %Y"),
+        'customer': rng.choice(CUSTOMERS),
+        'place_of_supply': rng.choice([state for state in STATES if state != HOME_STATE]) if igst else HOME_STATE,
+        'igst': igst,
+        'items': items,
+        'round_off': round(round(amount) - amount, 2),
+        'total_amount': float(round(amount)),
+    }
+
+def item_lines(index: int, item: dict) -> list:
+    # One item of the table, discounted items show the price before discount on a second line
+    quantity = f"{item['quantity']} {item['unit']}" if item['unit'] else str(item['quantity'])
+    tail = f"{quantity}{money(item['taxable_value'])}{money(item['tax_amount'])} ({item['tax_percentage']}%){money(item['amount'])}"
+    if item['discount']:
+        return [f"{index}{item['name']}  {money(item['rate'])}", f"{money(item['cost_price'])} (-{item['discount']}%){tail}"]
+    return [f"{index}{item['name']}  {money(item['rate'])} {tail}"]
+
+def invoice_pages(invoice: dict) -> list:
+    # The text lines of every page, ₹ is written as RUPEE_CODE
+    rupee = RUPEE_CODE.decode('latin-1')
+    letterhead = ["TA X  I N V O I C E O R I G I N A L  F O R  R E C I P I E N T ", "SYNTHETIC DERMACARE PRIVATE LIMITED",
+                  "GSTIN 23AABCS1234F1ZX     "]
+    table_header = "#Item Rate / Item QtyTaxable ValueTax AmountAmount"
+    lines = letterhead + [
+        "2nd Floor, Synthetic Towers, Station Road",
+        "Bhopal, MADHYA PRADESH, 462001",
+        "Mobile +91 9000000000   Email billing@synthetic.example",
+        f"Invoice #: {invoice['invoice_number']} Invoice Date: {invoice['invoice_date']} Due Date: {invoice['due_date']}",
+        "Customer Details:",
+        invoice['customer'],
+        "Ph: 9000000001Shipping Address:",
+        "Main Market",
+        "Place of Supply: ",
+        invoice['place_of_supply'],
+        table_header,
+    ]
+    for index, item in enumerate(invoice['items'], start=1):
+        lines.extend(item_lines(index, item))
+
+    taxable_value = sum(item['taxable_value'] for item in invoice['items'])
+    lines.append(f"Taxable Amount {rupee}{money(taxable_value)}")
+    by_rate = {}
+    for item in invoice['items']:
+        by_rate[item['tax_percentage']] = by_rate.get(item['tax_percentage'], 0.0) + item['tax_amount']
+    for tax_percentage, tax_amount in sorted(by_rate.items()):
+        if invoice['igst']:
+            lines.append(f"IGST {tax_percentage:.1f}% {rupee}{money(tax_amount)}")
+        else:
+            lines.append(f"CGST {tax_percentage / 2:.1f}% {rupee}{money(tax_amount / 2)}")
+            lines.append(f"SGST {tax_percentage / 2:.1f}% {rupee}{money(tax_amount / 2)}")
+    lines += [
+        f"Round Off {invoice['round_off']:.2f}",
+        f"Total{rupee}{money(invoice['total_amount'])}",
+        f"Total Items / Qty : {len(invoice['items'])} / {sum(item['quantity'] for item in invoice['items'])}.000",
+        "Amount Paid",
+        "Bank Details:",
+        "Authorized Signatory ",
+    ]
+
+    # Split into pages, every page ends with the footer and the next one repeats the letterhead and table header
+    body_lines = PAGE_LINES - 2
+    pages = [lines[:body_lines]]
+    rest = lines[body_lines:]
+    continuation = letterhead[1:2] + [table_header]
+    while rest:
+        take = body_lines - len(continuation)
+        pages.append(continuation + rest[:take])
+        rest = rest[take:]
+    for number, page in enumerate(pages, start=1):
+        page.append("Swipe | Simple Invoicing, Billing and Payments | Visit getswipe.in")
+        page.append(f"Page {number} / {len(pages)} This is a computer generated document and requires no signature.")
+    return pages
+
+def _escape(text: str) -> bytes:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').encode('latin-1')
+
+def _stream(dictionary: bytes, data: bytes) -> bytes:
+    data = zlib.compress(data)
+    return b"<< " + dictionary + b" /Filter /FlateDecode /Length %d >>\nstream\n" % len(data) + data + b"\nendstream"
+
+def _write_pdf(objects: list) -> bytes:
+    # objects[0] is the catalog, references are "n 0 R" with n counted from 1
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+def _pdf(page_resources: list, page_contents: list, shared: list) -> bytes:
+    # Catalog, page tree, the shared objects (numbered from 3) and then every page with its content stream
+    first_page = 3 + len(shared)
+    kids = b" ".join(b"%d 0 R" % (first_page + 2 * i) for i in range(len(page_contents)))
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_contents))]
+    objects += shared
+    for resources, content in zip(page_resources, page_contents):
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources %s /Contents %d 0 R >>"
+                       % (PAGE_WIDTH, PAGE_HEIGHT, resources, len(objects) + 2))
+        objects.append(_stream(b"", content))
+    return _write_pdf(objects)
+
+def text_pdf(pages: list) -> bytes:
+    # Every line is its own Tj, so the text layer extracts line by line
+    font = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding /ToUnicode 4 0 R >>"
+    contents = []
+    for lines in pages:
+        content = b"BT /F1 %d Tf %d TL %d %d Td " % (FONT_SIZE, LEADING, MARGIN, PAGE_HEIGHT - MARGIN)
+        content += b" ".join(b"(" + _escape(line) + b") Tj T*" for line in lines) + b" ET"
+        contents.append(content)
+    resources = b"<< /Font << /F1 3 0 R >> >>"
+    return _pdf([resources] * len(pages), contents, [font, _stream(b"", TO_UNICODE_CMAP)])
+
+def scanned_pdf(pages: list) -> bytes:
+    # Every page is a grayscale image of its lines and nothing else, like a scan
+    from PIL import Image, ImageDraw, ImageFont
+
+    scale = SCAN_DPI / 72
+    width, height = int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)
+    font = ImageFont.load_default(size=int(FONT_SIZE * scale))
+    images = []
+    for lines in pages:
+        image = Image.new('L', (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        for i, line in enumerate(lines):
+            text = line.replace(RUPEE_CODE.decode('latin-1'), '₹')
+            draw.text((MARGIN * scale, (MARGIN + i * LEADING) * scale), text, fill=0, font=font)
+        images.append(_stream(b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray /BitsPerComponent 8"
+                              % (width, height), image.tobytes()))
+    resources = [b"<< /XObject << /Im0 %d 0 R >> >>" % (3 + i) for i in range(len(pages))]
+    contents = [b"q %d 0 0 %d 0 0 cm /Im0 Do Q" % (PAGE_WIDTH, PAGE_HEIGHT)] * len(pages)
+    return _pdf(resources, contents, images)
+
+def generate(output_dir: Path, count: int, seed: int = 1, igst_share: float = 0.3, scanned_share: float = 0.0,
+             max_items: int = 12) -> list:
+    """
+    Write count synthetic invoices to output_dir and their truth.jsonl, returns the paths of the PDFs.
+    """
+    rng = random.Random(seed)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    with open(output_dir / 'truth.jsonl', 'w') as truth:
+        for number in range(1, count + 1):
+            invoice = make_invoice(rng, number, igst_share, max_items)
+            scanned = rng.random() < scanned_share
+            pages = invoice_pages(invoice)
+            path = output_dir / f"{invoice['invoice_number']}_{invoice['customer'].replace(' ', '_')}.pdf"
+            path.write_bytes(scanned_pdf(pages) if scanned else text_pdf(pages))
+            paths.append(path)
+            truth.write(json.dumps({
+                'file': path.name,
+                'invoice_number': invoice['invoice_number'],
+                'invoice_date': invoice['invoice_date'],
+                'due_date': invoice['due_date'],
+                'total_amount': invoice['total_amount'],
+                'items': len(invoice['items']),
+                'igst': invoice['igst'],
+                'scanned': scanned,
+                'pages': len(pages),
+            }) + "\n")
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic invoices.")
+    parser.add_argument('--output-dir', type=str, default='synthetic', help='Directory the PDFs are written to.')
+    parser.add_argument('--count', type=int, default=1000, help='Number of invoices.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generator.')
+    parser.add_argument('--igst-share', type=float, default=0.3, help='Share of IGST invoices, the others are SGST/CGST.')
+    parser.add_argument('--scanned-share', type=float, default=0.0, help='Share of rasterized invoices (OCR needs pdftoppm and tesseract).')
+    parser.add_argument('--max-items', type=int, default=12, help='Most items on an invoice, more than about 20 run over two pages.')
+    args = parser.parse_args()
+
+    paths = generate(Path(args.output_dir), args.count, seed=args.seed, igst_share=args.igst_share,
+                     scanned_share=args.scanned_share, max_items=args.max_items)
+    print(f"Wrote {len(paths)} invoices to {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
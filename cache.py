@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+import extract
+import accuracy_check
+import line_items
+
+
+class ResultCache:
+    """
+    On-disk cache of extraction results, keyed by the content hash of the PDF
+    and the version of the extracter and checker that produced the result.
+    Every entry is a small json file holding the sale_summary and its accuracy.
+    """
+    def __init__(self, cache_dir: Path, max_entries: int = 100000, max_age_days: float = 180) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.version = f"{extract.EXTRACTOR_VERSION}-{accuracy_check.CHECKER_VERSION}"
+
+    def key(self, file_path: Path, extracter_options: dict = None) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(self.version.encode())
+        # Options such as the OCR resolution can change the result too
+        digest.update(json.dumps(extracter_options or {}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f'{key}.json'
+
+    def get(self, key: str):
+        # Returns (sale_summary, accuracy) or None on a miss
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Touch the entry so that eviction drops the least recently used entries first
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return entry['sale_summary'], entry['accuracy']
+
+    def put(self, key: str, sale_summary: dict, accuracy: float) -> None:
+        entry_path = self._entry_path(key)
+        entry_path.parent.mkdir(exist_ok=True)
+        # Write to a temporary file first so that a crash or a parallel worker never leaves a half written entry
+        tmp_path = entry_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'sale_summary': sale_summary, 'accuracy': accuracy}, f, default=line_items.to_json)
+        os.replace(tmp_path, entry_path)
+
+    def clear(self) -> None:
+        for entry_path in self.cache_dir.glob('*/*.json'):
+            entry_path.unlink(missing_ok=True)
+
+    def evict(self) -> int:
+        # Drop entries older than max_age_days, then the least recently used ones above max_entries
+        entries = []
+        for entry_path in self.cache_dir.glob('*/*.json'):
+            try:
+                entries.append((entry_path.stat().st_mtime, entry_path))
+            except OSError:
+                continue
+        entries.sort(reverse=True)
+
+        oldest_allowed = time.time() - self.max_age_days * 24 * 3600
+        evicted = 0
+        for i, (mtime, entry_path) in enumerate(entries):
+            if i >= self.max_entries or mtime < oldest_allowed:
+                entry_path.unlink(missing_ok=True)
+                evicted += 1
+        return evicted
@@ -0,0 +1,202 @@
+"""
+Columnar output of the extracted invoices, written with --parquet. Needs pyarrow (pip install pyarrow).
+
+Two Parquet datasets are written under <output-dir>/parquet:
+  - line_items/: one row per item of every invoice, with the invoice keys on every row
+  - invoices/:   one row per invoice with its header fields, totals and accuracy
+Every row_group_size invoices, the rows buffered so far are written as a new part file with a name of its own,
+so memory stays bounded, and readers can load only the columns they need, e.g.
+    pyarrow.parquet.read_table('extracts/parquet/line_items', columns=['invoice_number', 'amount'])
+A full run replaces the datasets once it is complete, until then its parts are kept in a hidden directory.
+With append (--resume, --watch) the parts are added to the datasets as soon as they are written, together with the
+parts of a full run that was killed. Every row carries the path of its file, and a file written again replaces
+its earlier rows: they are removed from the older parts once the new part is written. If a run dies in between,
+the rows of the newest part win the next time the datasets are appended to.
+Part files are written under a hidden name and renamed once complete, readers never see a partial file.
+"""
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+LINE_ITEM_SCHEMA = pa.schema([
+    ('path', pa.string()),
+    ('file', pa.string()),
+    ('invoice_number', pa.string()),
+    ('invoice_date', pa.string()),
+    ('item_index', pa.int32()),
+    ('items', pa.string()),
+    ('rate', pa.float64()),
+    ('cost_price', pa.float64()),
+    ('discount', pa.string()),
+    ('quantity', pa.string()),
+    ('taxable_value', pa.float64()),
+    ('tax_amount', pa.float64()),
+    ('tax_percentage', pa.float64()),
+    ('amount', pa.float64()),
+    ('sgst_amount', pa.float64()),
+    ('cgst_amount', pa.float64()),
+    ('igst_amount', pa.float64()),
+    ('sgst_rate', pa.float64()),
+    ('cgst_rate', pa.float64()),
+    ('igst_rate', pa.float64()),
+])
+
+INVOICE_SCHEMA = pa.schema([
+    ('path', pa.string()),
+    ('file', pa.string()),
+    ('invoice_number', pa.string()),
+    ('invoice_date', pa.string()),
+    ('due_date', pa.string()),
+    ('gstin', pa.string()),
+    ('place_of_supply', pa.string()),
+    ('total_amount', pa.float64()),
+    ('item_count', pa.int32()),
+    ('accuracy', pa.float64()),
+    ('taxable_value', pa.float64()),
+    ('sgst_amount', pa.float64()),
+    ('cgst_amount', pa.float64()),
+    ('igst_amount', pa.float64()),
+    ('sgst_rate', pa.float64()),
+    ('cgst_rate', pa.float64()),
+    ('igst_rate', pa.float64()),
+    ('tax_amount', pa.float64()),
+    ('tax_rate', pa.float64()),
+])
+
+# Files and directories starting with '.' are skipped by pyarrow when it reads a dataset
+STAGING_PREFIX = '.run-'
+
+
+def _write_part(table: pa.Table, part_path: Path) -> None:
+    in_progress = part_path.parent / f'.{part_path.name}.inprogress'
+    pq.write_table(table, in_progress)
+    os.replace(in_progress, part_path)
+
+
+class _DatasetWriter:
+    # Buffers the rows of one dataset column by column and writes every flush as a new part file
+    def __init__(self, dataset_dir: Path, schema: pa.Schema, run_id: str, append: bool = False) -> None:
+        self.dataset_dir = dataset_dir
+        self.dataset_dir.mkdir(parents=True, exist_ok=True)
+        # Left behind by runs that were killed: partial files are dropped, the complete parts of a full run are
+        # kept when appending, the rows a full run writes again replace them anyway
+        for leftover in self.dataset_dir.glob('.*.inprogress'):
+            leftover.unlink()
+        for leftover in self.dataset_dir.glob(f'{STAGING_PREFIX}*'):
+            if append:
+                for part in leftover.glob('*.parquet'):
+                    os.replace(part, self.dataset_dir / part.name)
+            shutil.rmtree(leftover, ignore_errors=True)
+        self.schema = schema
+        self.run_id = run_id
+        self.appending = append
+        self.part_dir = dataset_dir if append else dataset_dir / f'{STAGING_PREFIX}{run_id}'
+        self.part_dir.mkdir(exist_ok=True)
+        self.parts = 0
+        self.columns = {name: [] for name in schema.names}
+        self.rows = 0
+        # Part of the rows of every path when appending, and the paths to remove from every part
+        self.part_of = {}
+        self.superseded = {}
+        if append:
+            for part in sorted(self.dataset_dir.glob('*.parquet')):
+                for path in set(pq.read_table(part, columns=['path']).column('path').to_pylist()):
+                    self.supersede(path)
+                    self.part_of[path] = part.name
+
+    def supersede(self, path: str) -> None:
+        # The rows of path are written again, those already in the dataset are removed after the next flush
+        part_name = self.part_of.pop(path, None)
+        if part_name is not None:
+            self.superseded.setdefault(part_name, set()).add(path)
+
+    def append(self, row: dict) -> None:
+        for name, values in self.columns.items():
+            values.append(row.get(name))
+        self.rows += 1
+
+    def flush(self) -> None:
+        if self.rows:
+            part_name = f'part-{self.run_id}-{self.parts:05d}.parquet'
+            _write_part(pa.table(self.columns, schema=self.schema), self.part_dir / part_name)
+            self.parts += 1
+            for values in self.columns.values():
+                values.clear()
+            self.rows = 0
+        # Only once the new rows are written, so that a file always has rows in the dataset
+        for part_name, paths in self.superseded.items():
+            part_path = self.dataset_dir / part_name
+            table = pq.read_table(part_path)
+            table = table.filter(pc.invert(pc.is_in(table.column('path'), value_set=pa.array(sorted(paths), pa.string()))))
+            if table.num_rows:
+                _write_part(table, part_path)
+            else:
+                part_path.unlink()
+        self.superseded.clear()
+
+    def close(self) -> None:
+        self.flush()
+        if self.appending:
+            return
+        # Replace the parts of the previous runs only now that this one is complete
+        for old_part in self.dataset_dir.glob('*.parquet'):
+            old_part.unlink()
+        for part in sorted(self.part_dir.glob('*.parquet')):
+            os.replace(part, self.dataset_dir / part.name)
+        self.part_dir.rmdir()
+
+
+class ParquetSink:
+    def __init__(self, output_dir: Path, row_group_size: int = 1000, append: bool = False) -> None:
+        self.row_group_size = row_group_size
+        # Part names sort in the order of the runs that wrote them
+        run_id = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{os.getpid()}"
+        self.line_items = _DatasetWriter(Path(output_dir) / 'line_items', LINE_ITEM_SCHEMA, run_id, append)
+        self.invoices = _DatasetWriter(Path(output_dir) / 'invoices', INVOICE_SCHEMA, run_id, append)
+        self.pending_invoices = 0
+
+    def written_paths(self) -> set:
+        # Paths of the files that already have rows in the invoices dataset, when appending
+        return set(self.invoices.part_of)
+
+    def write(self, file_path: Path, sale_summary: dict, accuracy: float, totals: dict) -> None:
+        # totals is the outputs.csv row of the invoice (see aggregate.invoice_totals)
+        # Every column is read once, sale_info is a dict or a line_items.SaleInfo
+        sale_info = dict(sale_summary['sale_info'])
+        item_count = len(sale_info['items'])
+        path = str(file_path)
+        self.line_items.supersede(path)
+        self.invoices.supersede(path)
+        for i in range(item_count):
+            row = {name: values[i] for name, values in sale_info.items()}
+            row['path'] = path
+            row['file'] = file_path.name
+            row['invoice_number'] = sale_summary['invoice_number']
+            row['invoice_date'] = sale_summary['invoice_date']
+            row['item_index'] = i
+            self.line_items.append(row)
+
+        invoice = dict(totals)
+        invoice.update({name: value for name, value in sale_summary.items() if name != 'sale_info'})
+        invoice['path'] = path
+        invoice['file'] = file_path.name
+        invoice['item_count'] = item_count
+        invoice['accuracy'] = accuracy
+        self.invoices.append(invoice)
+
+        self.pending_invoices += 1
+        if self.pending_invoices >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        self.line_items.flush()
+        self.invoices.flush()
+        self.pending_invoices = 0
+
+    def close(self) -> None:
+        self.line_items.close()
+        self.invoices.close()
@@ -1,13 +1,56 @@
-import pandas as pd
 import PyPDF2
 import re
 from pathlib import Path
 import logging
-from pdf2image import convert_from_path
-import cv2
-import numpy as np
-import pytesseract
-from PIL import Image
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import accuracy_check
+import line_items
+import ocr
+import templates
+import timing
+import log_config
+
+# Bump this whenever a change to the extraction can change its output, it invalidates the result cache
+EXTRACTOR_VERSION = "2"
+
+# Header fields
+INVOICE_NUMBER_PATTERN = re.compile(r"Invoice #:\s*(\S+)")
+INVOICE_DATE_PATTERN = re.compile(r"Invoice Date:\s*(\d{1,2} \w+ \d{4})")
+DUE_DATE_PATTERN = re.compile(r"Due Date:\s*(\d{1,2} \w+ \d{4})")
+GSTIN_PATTERN = re.compile(r"GSTIN\s*([\w\d]+)")
+TOTAL_AMOUNT_PATTERN = re.compile(r"Total\s*₹([\d,\.]+)")
+PLACE_OF_SUPPLY_PATTERN = re.compile(r"(\d{2}-[A-Z]*\s*[A-Z]*)")
+IGST_PATTERN = re.compile(r"igst", re.IGNORECASE)
+
+# Item table, every item starts with its serial number followed by the item name
+ITEMS_PATTERN = re.compile(r"(?<=Amount\n)(.*?)Taxable Amount", re.DOTALL)
+ITEM_SPLIT_PATTERN = re.compile(r"(\d[a-zA-Z][\s\S]+?)(?=\n\d+[a-zA-Z]|\Z)", re.MULTILINE)
+# The serial number digit in front of the item name
+ITEM_PREFIX_PATTERN = re.compile(r"\d")
+NEWLINES_PATTERN = re.compile(r'[\r\n]+')
+
+# Multi-page documents, the item table starts after its header and ends at the "Taxable Amount" line.
+# On a page the table runs past, the lines after the last one that ends in an amount or starts an item are the page footer.
+TABLE_START = "Amount\n"
+TABLE_END = "Taxable Amount"
+ITEM_LINE_END_PATTERN = re.compile(r"(?:\.\d{2}[ \t]*|^\d+[a-zA-Z].*)$", re.MULTILINE)
+
+# Columns of an item line, matched one after the other from the end of the line.
+# "$" matches at the endpos passed to search(), which is how the line is consumed without rebuilding it.
+AMOUNT_PATTERN = re.compile(r"(\d{1,3}(?:,\d{2,3})*\.\d{2})(?=$)")
+TAX_PATTERN = re.compile(r"(?<=\.\d{2})((\d{1,3}(?:,\d{2,3})*\.\d{2})\s\((\d{1,2})%\))(?=$)")
+TAXABLE_VALUE_PATTERN = re.compile(r"(?<=\w)(\d{1,3}(?:,\d{2,3})*\.\d{2})(?=$)")
+QUANTITY_PATTERN = re.compile(r"(\d+|\d+\s[A-Z]+)(?=$)")
+DISCOUNT_PATTERN = re.compile(r"\((-\d{1,2}%|-\d{1,2}\.\d{1,2}%)\)(?=$)")
+
+# Page classification, from the page objects only and without extracting the text.
+# A page needs at least this many text showing operators for its text layer to be trusted.
+MIN_TEXT_OPERATORS = 20
+TEXT_OPERATOR_PATTERN = re.compile(rb"\bT[jJ]\b")
+PAGE_CLASSES = ('text', 'mixed', 'scanned', 'empty')
 
 def convert_to_float(value):
     try:
@@ -17,226 +60,491 @@ def convert_to_float(value):
         # Return None if the conversion fails
         return None
 
-class Extracter:
-    def __init__(self, file_path: Path) -> None:
-        self.file_path = file_path
-        # Create logs directory if it doesn't exist
-        log_dir = Path('logs')
-        log_dir.mkdir(exist_ok=True)
-
-        # Create a logger with a unique name for each file (based on the file name)
-        self.logger = logging.getLogger(file_path.stem)
-        self.logger.setLevel(logging.DEBUG)
-
-        # Prevent this logger's messages from propagating to the root logger
-        self.logger.propagate = False
-
-        # If logger already has handlers, remove them (to avoid duplicates)
-        if self.logger.hasHandlers():
-            self.logger.handlers.clear()
-
-        # Create a file handler for logging to a file in overwrite mode ('w')
-        log_file = log_dir / f'{file_path.stem}.log'
-        file_handler = logging.FileHandler(log_file, mode='w')  # Overwrite if file exists
-        file_handler.setLevel(logging.DEBUG)
-
-        # Create a log message format
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-
-        # Add the file handler to the logger
-        self.logger.addHandler(file_handler)
+def _strip_end(line: str, end: int) -> int:
+    # Move end back over trailing whitespace
+    while end > 0 and line[end - 1].isspace():
+        end -= 1
+    return end
+
+def _tail_start(line: str, end: int, chars: str, spaces: bool = False, capitals: bool = False) -> int:
+    # Start of the run of characters before end that a column pattern can match.
+    # Searching from there gives the same match as searching the whole line, without scanning the item name.
+    start = end
+    while start > 0:
+        c = line[start - 1]
+        if not (c.isdecimal() or c in chars or (spaces and c.isspace()) or (capitals and 'A' <= c <= 'Z')):
+            break
+        start -= 1
+    return start
+
+def _search_tail(pattern, line: str, end: int, chars: str, spaces: bool = False, capitals: bool = False):
+    return pattern.search(line, _tail_start(line, end, chars, spaces, capitals), end)
+
+def parse_item_line(line: str):
+    """
+    Parse one line of the item table from right to left.
+    Returns (item, rate, cost_price, discount, quantity, taxable_value, tax_amount, tax_percentage, amount),
+    all as the strings found in the line (or None) except tax_percentage which is a float.
+    """
+    end = _strip_end(line, len(line))
+
+    amount = None
+    match = _search_tail(AMOUNT_PATTERN, line, end, ",.")
+    if match is not None:
+        amount = match.group(1)
+        end = _strip_end(line, match.start())
+
+    match = _search_tail(TAX_PATTERN, line, end, ",.()%", spaces=True)
+    if match is None:
+        raise ValueError(f"Tax amount not found for item: {line}")
+    tax_amount = match.group(2)
+    tax_percentage = convert_to_float(match.group(3))
+    end = _strip_end(line, match.start())
+
+    taxable_value = None
+    match = _search_tail(TAXABLE_VALUE_PATTERN, line, end, ",.")
+    if match is not None:
+        taxable_value = match.group(1)
+        end = _strip_end(line, match.start())
+
+    quantity = None
+    match = _search_tail(QUANTITY_PATTERN, line, end, "", spaces=True, capitals=True)
+    if match is not None:
+        quantity = match.group(1)
+        end = _strip_end(line, match.start())
+
+    discount = None
+    match = _search_tail(DISCOUNT_PATTERN, line, end, "(-.%)")
+    if match is not None:
+        discount = match.group(1)
+        end = _strip_end(line, match.start())
+
+    cost_price = None
+    match = _search_tail(AMOUNT_PATTERN, line, end, ",.")
+    if match is not None:
+        cost_price = match.group(1)
+        end = _strip_end(line, match.start())
+
+    rate = cost_price
+    match = _search_tail(AMOUNT_PATTERN, line, end, ",.")
+    if match is not None:
+        rate = match.group(1)
+        end = _strip_end(line, match.start())
+
+    return line[:end], rate, cost_price, discount, quantity, taxable_value, tax_amount, tax_percentage, amount
+
+
+# The layout of the invoices this extracter was written for, and the fallback when no template matches.
+# Other layouts are added with templates.register, after this one.
+DEFAULT_TEMPLATE = templates.Template(
+    name='default',
+    anchors=("Invoice #:", "Invoice Date:", "Due Date:", TABLE_END),
+    fields={
+        'invoice_number': INVOICE_NUMBER_PATTERN,
+        'invoice_date': INVOICE_DATE_PATTERN,
+        'due_date': DUE_DATE_PATTERN,
+        'gstin': GSTIN_PATTERN,
+        'total_amount': TOTAL_AMOUNT_PATTERN,
+        'place_of_supply': PLACE_OF_SUPPLY_PATTERN,
+    },
+    table_start=TABLE_START,
+    table_end=TABLE_END,
+    parse_item=parse_item_line,
+    igst_pattern=IGST_PATTERN,
+    item_split_pattern=ITEM_SPLIT_PATTERN,
+    item_prefix_pattern=ITEM_PREFIX_PATTERN,
+    item_line_end_pattern=ITEM_LINE_END_PATTERN,
+)
+templates.register(DEFAULT_TEMPLATE)
+
+def item_line(template: templates.Template, match: str) -> str:
+    # An item found by the item_split_pattern of template as a single line, without its prefix
+    line = NEWLINES_PATTERN.sub(' ', match)
+    if template.item_prefix_pattern is not None:
+        prefix = template.item_prefix_pattern.match(line)
+        if prefix is not None:
+            line = line[prefix.end():]
+    return line.strip()
+
+def _count_xobjects(resources, depth: int = 1):
+    """
+    Count the text showing operators and the images drawn by the XObjects of a resource dictionary, going into
+    form XObjects up to depth levels down. Returns (text_operators, images).
+    The text of a form only counts if it has fonts, its own or those of the resources it is drawn from.
+    """
+    xobjects = resources.get('/XObject') if resources else None
+    if not xobjects:
+        return 0, 0
+    text_operators = 0
+    images = 0
+    for xobject in xobjects.get_object().values():
+        xobject = xobject.get_object()
+        if xobject.get('/Subtype') == '/Image':
+            images += 1
+        elif xobject.get('/Subtype') == '/Form' and depth > 0:
+            form_resources = xobject.get('/Resources')
+            form_resources = form_resources.get_object() if form_resources is not None else None
+            if (form_resources or resources).get('/Font'):
+                text_operators += len(TEXT_OPERATOR_PATTERN.findall(xobject.get_data()))
+            if form_resources is not None:
+                form_text_operators, form_images = _count_xobjects(form_resources, depth - 1)
+                text_operators += form_text_operators
+                images += form_images
+    return text_operators, images
+
+def _content_data(page) -> bytes:
+    contents = page.get('/Contents')
+    if contents is None:
+        return b''
+    contents = contents.get_object()
+    if isinstance(contents, PyPDF2.generic.ArrayObject):
+        return b'\n'.join(stream.get_object().get_data() for stream in contents)
+    return contents.get_data()
+
+def classify_page(page) -> str:
+    """
+    Classify a page from cheap signals: its fonts, the text showing operators of its content stream and its images,
+    those drawn by its form XObjects included (stamped or re-exported PDFs often wrap the whole page in a form).
+      - text:    a real text layer, parse it with PyPDF2
+      - mixed:   images with a tiny text layer (e.g. a scan with a stamped header), OCR it
+      - scanned: images and no text at all, OCR it
+      - empty:   neither text nor images
+    """
+    resources = page.get('/Resources')
+    resources = resources.get_object() if resources is not None else None
+    has_fonts = bool(resources and resources.get('/Font'))
+    text_operators = len(TEXT_OPERATOR_PATTERN.findall(_content_data(page))) if has_fonts else 0
+    form_text_operators, images = _count_xobjects(resources)
+    text_operators += form_text_operators
+
+    if text_operators >= MIN_TEXT_OPERATORS or (text_operators > 0 and images == 0):
+        return 'text'
+    if images > 0:
+        return 'mixed' if text_operators > 0 else 'scanned'
+    return 'empty'
+
+def _release_page(reader, page) -> None:
+    # Drop the objects of a page that is done (content streams, fonts, images) from the reader's object cache,
+    # where PyPDF2 keeps everything it has read, so that reading a long document holds one page at a time.
+    # Only objects that are in the cache are visited, nothing is read from the file.
+    pending = [value for key, value in dict.items(page) if key != '/Parent']
+    while pending:
+        value = pending.pop()
+        if isinstance(value, PyPDF2.generic.IndirectObject):
+            value = reader.resolved_objects.pop((value.generation, value.idnum), None)
+        if isinstance(value, dict):
+            pending.extend(child for key, child in dict.items(value) if key != '/Parent')
+        elif isinstance(value, list):
+            pending.extend(value)
+
+class PageStreamParser:
+    """
+    Parses an invoice that spans several pages, fed one page of text at a time.
+    The header fields and the total are taken from the first page that holds them, the item table is
+    stitched across page breaks: the last item of a page is carried over, since it can continue on the
+    next page, and every other item is parsed as soon as its page is read. Only the text of one page
+    and the carried item are held, besides the parsed items in a line_items.SaleInfo.
+    """
+    def __init__(self, logger, template: templates.Template = DEFAULT_TEMPLATE) -> None:
+        self.logger = logger
+        self.template = template
+        self.fields = {field: None for field in template.fields}
+        self.has_igst = False
+        # 'before', 'in' or 'after' the item table
+        self.table = 'before'
+        self.carry = ""
+        self.sale_info = line_items.SaleInfo()
+
+    def feed(self, page_text: str) -> None:
+        if page_text == "":
+            return
+        for field, value in self.fields.items():
+            if value is None:
+                match = self.template.fields[field].search(page_text)
+                if match:
+                    self.fields[field] = match.group(1)
+        if not self.has_igst and self.template.igst_pattern.search(page_text):
+            self.has_igst = True
+
+        if self.table == 'after':
+            return
+        # The table starts after its header, which continuation pages usually repeat
+        start = page_text.find(self.template.table_start)
+        if start != -1:
+            table_text = page_text[start + len(self.template.table_start):]
+        elif self.table == 'in':
+            table_text = page_text
+        else:
+            return
+        self.table = 'in'
 
-        # Test log to ensure everything works
-        self.logger.debug("Logger initialized and logging to file.")
-        self.logger.info(f'Initializing PDF reader for file: {file_path}')
+        end = table_text.find(self.template.table_end)
+        if end != -1:
+            table_text = table_text[:end]
+            self.table = 'after'
+        else:
+            last_line = None
+            for last_line in self.template.item_line_end_pattern.finditer(table_text):
+                pass
+            if last_line is not None:
+                table_text = table_text[:last_line.end()]
+
+        chunk = self.carry + "\n" + table_text if self.carry else table_text
+        if self.table == 'after':
+            chunk = chunk.rstrip()
+        matches = self.template.item_split_pattern.findall(chunk)
+        self.carry = matches.pop() if matches and self.table == 'in' else ""
+        for match in matches:
+            self.add_item(match)
+
+    def add_item(self, match: str) -> None:
+        line = item_line(self.template, match)
+        self.logger.debug("%s", line)
+        item, rate, cost_price, discount, quantity, taxable_value, tax_amount, tax_percentage, amount = self.template.parse_item(line)
+        self.sale_info.append(item, convert_to_float(rate), convert_to_float(cost_price), discount, quantity,
+                              convert_to_float(taxable_value), convert_to_float(tax_amount), tax_percentage, convert_to_float(amount))
+
+    def finish(self) -> dict:
+        if self.carry:
+            self.add_item(self.carry)
+            self.carry = ""
+        if self.table == 'before':
+            raise ValueError(f"Item table not found (layout template {self.template.name})")
+        if self.table == 'in':
+            self.logger.warning("End of the item table not found, the items up to the last page were read")
+
+        # Whether the taxes are IGST or split into SGST and CGST is only known once every page is read
+        self.sale_info.has_igst = self.has_igst
+
+        return {
+            'invoice_number': self.fields['invoice_number'],
+            'invoice_date': self.fields['invoice_date'],
+            'due_date': self.fields['due_date'],
+            'gstin': self.fields['gstin'],
+            'place_of_supply': self.fields['place_of_supply'],
+            'total_amount': convert_to_float(self.fields['total_amount']),
+            'sale_info': self.sale_info
+        }
 
-    def preprocess_image(self, image):
-        # Convert to grayscale
-        gray = cv2.cvtColor(np.array(image), cv2.COLOR_BGR2GRAY)
-        # Apply thresholding
-        _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
-        return Image.fromarray(thresh)
+class Extracter:
+    def __init__(self, file_path: Path, ocr_dpi: int = ocr.DEFAULT_DPI, ocr_workers: int = 1, ocr_mode: str = 'page',
+                 timer: timing.StageTimer = None) -> None:
+        self.file_path = file_path
+        self.ocr_dpi = ocr_dpi
+        self.ocr_workers = ocr_workers
+        self.ocr_mode = ocr_mode
+        # Filled in by extract, the class of every page and the time spent in every stage
+        self.page_classes = []
+        self.template = None
+        self.timer = timer if timer is not None else timing.StageTimer()
+        # All files log to the same logger, with the file name as the file_id of every record (see log_config.py)
+        self.logger = log_config.get_logger(file_path.stem)
+        self.logger.info('Initializing PDF reader for file: %s', file_path)
 
     def useOCR(self, pdf_path) -> str:
-        images = convert_from_path(pdf_path)
-        preprocessed_images = [self.preprocess_image(image) for image in images]
-        extracted_text = ""
-        for image in preprocessed_images:
-            text = pytesseract.image_to_string(image)
-            extracted_text += text + "\n"
-
-        return extracted_text
-
-    def extract_item_details(self, match, cleaned_matches, i):
-        if match is not None:
-            extract = match.group(1)
-            cleaned_matches[i] = re.sub(rf"{re.escape(extract)}(?=$)", "", cleaned_matches[i], count=1).strip()
-            return extract
-        return None
+        # Pages are rendered and OCR'd one at a time, see ocr.py
+        with self.timer.stage('ocr'):
+            return ocr.ocr_pdf(
+                pdf_path, page_count=len(self.pdf_reader.pages), dpi=self.ocr_dpi, workers=self.ocr_workers, mode=self.ocr_mode,
+                timer=self.timer
+            )
+
+    def ocr_page(self, page_number: int, single_thread: bool = False) -> str:
+        # OCR a single page of a multi-page document
+        with self.timer.stage('ocr'):
+            return ocr.ocr_page(str(self.file_path), page_number, dpi=self.ocr_dpi, single_thread=single_thread, mode=self.ocr_mode,
+                                timer=self.timer)
+
+    def read_page(self, page) -> str:
+        # Classify a page and read its text layer, None if the page has to be OCR'd. The page is released afterwards.
+        with self.timer.stage('classify'):
+            page_class = classify_page(page)
+        self.page_classes.append(page_class)
+        page_text = None
+        if page_class not in ('scanned', 'mixed'):
+            with self.timer.stage('extract_text'):
+                page_text = page.extract_text()
+            if page_text == "":
+                page_text = None
+        _release_page(self.pdf_reader, page)
+        return page_text
+
+    def iter_page_texts(self):
+        """
+        Yield the text of every page in page order, reading the pages one after the other.
+        With ocr_workers > 1 the pages to OCR are handed to a thread pool and the next pages are read meanwhile,
+        until ocr_workers pages are being OCR'd or 2 * ocr_workers pages wait to be yielded, so that a run of
+        scanned pages is OCR'd ocr_workers pages at a time while memory stays bounded.
+        """
+        pages = enumerate(self.pdf_reader.pages, start=1)
+        if self.ocr_workers <= 1:
+            for page_number, page in pages:
+                page_text = self.read_page(page)
+                yield self.ocr_page(page_number) if page_text is None else page_text
+            return
+
+        # Page texts and OCR futures, in page order
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.ocr_workers) as executor:
+            for page_number, page in pages:
+                page_text = self.read_page(page)
+                pending.append(executor.submit(self.ocr_page, page_number, True) if page_text is None else page_text)
+                while pending:
+                    if isinstance(pending[0], Future):
+                        in_flight = sum(isinstance(entry, Future) for entry in pending)
+                        if in_flight < self.ocr_workers and len(pending) < 2 * self.ocr_workers:
+                            break
+                        yield pending.popleft().result()
+                    else:
+                        yield pending.popleft()
+            while pending:
+                entry = pending.popleft()
+                yield entry.result() if isinstance(entry, Future) else entry
+
+    def select_template(self, page_text: str) -> templates.Template:
+        # One pass of the combined anchor pattern of all the templates over the text
+        with self.timer.stage('template'):
+            self.template, anchors_found = templates.index().match(page_text)
+        self.logger.info("Using the %s template, %s of its %s anchors found", self.template.name, anchors_found,
+                         len(self.template.anchors))
+        return self.template
+
+    def extract_pages(self) -> dict:
+        # Multi-page documents are streamed page by page through a PageStreamParser,
+        # with the template picked from the first page that has text
+        parser = None
+        for page_number, page_text in enumerate(self.iter_page_texts(), start=1):
+            self.logger.debug("Page %s: %s", page_number, page_text)
+            if parser is None:
+                if page_text == "":
+                    continue
+                parser = PageStreamParser(self.logger, self.select_template(page_text))
+            parse_start = time.perf_counter()
+            parser.feed(page_text)
+            self.timer.add('parse', time.perf_counter() - parse_start)
+        self.logger.info("Pages classified as %s", self.page_classes)
+        if parser is None:
+            self.logger.error("No text found in PDF!!")
+            raise RuntimeError("No text found in PDF!!")
+
+        parse_start = time.perf_counter()
+        sale_summary = parser.finish()
+        self.timer.add('parse', time.perf_counter() - parse_start)
+        self.logger.info("Extracted %s items from %s pages.", len(sale_summary['sale_info']['items']), len(self.page_classes))
+        return sale_summary
 
     def extract_basic_info(self, page_text, pattern):
-        match = re.search(pattern, page_text)
+        match = pattern.search(page_text)
         if match:
             return match.group(1)
         return None
 
     def extract(self) -> dict:
+        # PyPDF2 reads the objects from the open file as they are needed, instead of loading the whole document
+        with open(self.file_path, 'rb') as pdf_file:
+            return self._extract(pdf_file)
+
+    def _extract(self, pdf_file) -> dict:
         # Initialize the PDF reader
         try:
-            self.pdf_reader = PyPDF2.PdfReader(str(self.file_path), strict=True)
+            with self.timer.stage('open'):
+                self.pdf_reader = PyPDF2.PdfReader(pdf_file, strict=True)
             self.logger.info('PDF reader initialized successfully.')
         except Exception as e:
-            self.logger.error(f'Error initializing PDF reader: {e}')
+            self.logger.error('Error initializing PDF reader: %s', e)
             raise
         
-        # Check if the PDF contains only 1 page
-        if len(self.pdf_reader.pages) > 1:
-            self.logger.error("More than one page found!!")
-            raise ValueError("More than one page found!!")
+        # Documents with more than one page are read one page at a time, single pages take the path below
+        page_count = len(self.pdf_reader.pages)
+        if page_count > 1:
+            self.logger.info("PDF contains %s pages, Extracting data page by page...", page_count)
+            return self.extract_pages()
         self.logger.info("PDF contains only 1 page, Extracting data from PDF...")
         
+        # Decide from the page objects whether the text layer can be used or the page has to be OCR'd
+        with self.timer.stage('classify'):
+            page_class = classify_page(self.pdf_reader.pages[0])
+        self.page_classes.append(page_class)
+        self.logger.info("Page classified as %s in %.2f ms", page_class, self.timer.stages['classify'] * 1000)
+
         # Check if the PDF contains any text
-        page_text = self.pdf_reader.pages[0].extract_text()
-        if page_text == "":
+        if page_class in ('scanned', 'mixed'):
             page_text = self.useOCR(pdf_path=str(self.file_path))
+        else:
+            with self.timer.stage('extract_text'):
+                page_text = self.pdf_reader.pages[0].extract_text()
+            if page_text == "":
+                page_text = self.useOCR(pdf_path=str(self.file_path))
         if page_text == "":
             self.logger.error("No text found in PDF!!")
             raise RuntimeError("No text found in PDF!!")
         self.logger.debug(page_text)
+        template = self.select_template(page_text)
 
         # Extract basic data
-        invoice_number = self.extract_basic_info(page_text, r"Invoice #:\s*(\S+)")
-        invoice_date = self.extract_basic_info(page_text, r"Invoice Date:\s*(\d{1,2} \w+ \d{4})")
-        due_date = self.extract_basic_info(page_text, r"Due Date:\s*(\d{1,2} \w+ \d{4})")
-        gstin = self.extract_basic_info(page_text, r"GSTIN\s*([\w\d]+)")
-        total_amount = convert_to_float(self.extract_basic_info(page_text, r"Total\s*₹([\d,\.]+)"))
-        place_of_supply = self.extract_basic_info(page_text, r"(\d{2}-[A-Z]*\s*[A-Z]*)")
-        igst = re.search(r"igst", page_text, re.IGNORECASE)
+        parse_start = time.perf_counter()
+        invoice_number = self.extract_basic_info(page_text, template.fields['invoice_number'])
+        invoice_date = self.extract_basic_info(page_text, template.fields['invoice_date'])
+        due_date = self.extract_basic_info(page_text, template.fields['due_date'])
+        gstin = self.extract_basic_info(page_text, template.fields['gstin'])
+        total_amount = convert_to_float(self.extract_basic_info(page_text, template.fields['total_amount']))
+        place_of_supply = self.extract_basic_info(page_text, template.fields['place_of_supply'])
+        igst = template.igst_pattern.search(page_text)
         if igst:
             has_igst = True
         else:
             has_igst = False
 
-        self.logger.info(f"Extracted basic data from PDF")
+        self.logger.info("Extracted basic data from PDF")
 
-        self.logger.debug(f"Invoice Number: {invoice_number}")
-        self.logger.debug(f"Invoice Date: {invoice_date}")
-        self.logger.debug(f"Due Date: {due_date}")
-        self.logger.debug(f"GSTIN: {gstin}")
-        self.logger.debug(f"Total Amount: ₹{total_amount}")
-        self.logger.debug(f"Place of Supply: {place_of_supply}")
+        self.logger.debug("Invoice Number: %s", invoice_number)
+        self.logger.debug("Invoice Date: %s", invoice_date)
+        self.logger.debug("Due Date: %s", due_date)
+        self.logger.debug("GSTIN: %s", gstin)
+        self.logger.debug("Total Amount: ₹%s", total_amount)
+        self.logger.debug("Place of Supply: %s", place_of_supply)
 
-        # pattern = r"#Item Rate / Item QtyTaxable ValueTax AmountAmount(.*?)Taxable Amount"
-        pattern = r"(?<=Amount\n)(.*?)Taxable Amount"
-        items = re.search(pattern, page_text, re.DOTALL)
+        items = template.items_pattern.search(page_text)
 
-        if items:
-            items_str = items.group(1).strip()
-            self.logger.debug(items_str)
-        else:
-            self.logger.warning("Items not found for this file!!")
-
-
-        pattern = r"(\d[a-zA-Z][\s\S]+?)(?=\n\d+[a-zA-Z]|\Z)"
-        matches = re.findall(pattern, items_str, re.MULTILINE)
-        cleaned_matches = [re.sub(r'[\r\n]+', ' ', match) for match in matches]
-
-        for i, match in enumerate(cleaned_matches):
-            cleaned_matches[i] = match[1:].strip()
-
-        sale_info = {
-        'items': [],
-        'rate': [],
-        'cost_price': [],
-        'discount': [],
-        'quantity': [],
-        'taxable_value': [],
-        'tax_amount': [],
-        'tax_percentage': [],
-        'amount': [],
-        'sgst_amount': [],
-        'cgst_amount': [],
-        'igst_amount': [],
-        'sgst_rate': [],
-        'cgst_rate': [],
-        'igst_rate': [],
-        }
+        if items is None:
+            raise ValueError(f"Item table not found (layout template {template.name})")
+        items_str = items.group(1).strip()
+        self.logger.debug(items_str)
+
+        matches = template.item_split_pattern.findall(items_str)
+        cleaned_matches = [item_line(template, match) for match in matches]
+
+        sale_info = line_items.SaleInfo(has_igst=has_igst)
 
         self.logger.info("Extracting data from list of items purchased...")
 
+        debug = self.logger.isEnabledFor(logging.DEBUG)
         for i in range(len(cleaned_matches)):
-            self.logger.debug(f"{cleaned_matches[i]}")
-            match = re.search(r"(\d{1,3}(?:,\d{2,3})*\.\d{2})(?=$)", cleaned_matches[i])
-            Amount = self.extract_item_details(match, cleaned_matches, i)
-            sale_info['amount'].append(convert_to_float(Amount))
-            
-            match = re.search(r"(?<=\.\d{2})(\d{1,3}(?:,\d{2,3})*\.\d{2}\s\(\d{1,2}%\))(?=$)", cleaned_matches[i])
-            Tax_amount = self.extract_item_details(match, cleaned_matches, i)
-            match = re.search(r"\((\d{1,2}%)\)(?=$)", Tax_amount)
-            Tax_percentage = convert_to_float(match.group(1).replace("%", ""))
-            sale_info['tax_percentage'].append(Tax_percentage)
-            Tax_amount = re.search(r"(\d{1,3}(?:,\d{2,3})*\.\d{2})", Tax_amount).group(1)
-            sale_info['tax_amount'].append(convert_to_float(Tax_amount))
-
-            match = re.search(r"(?<=\w)(\d{1,3}(?:,\d{2,3})*\.\d{2})(?=$)", cleaned_matches[i])
-            Taxable_value = self.extract_item_details(match, cleaned_matches, i)
-            sale_info['taxable_value'].append(convert_to_float(Taxable_value))
-            
-            match = re.search(r"(\d+|\d+\s[A-Z]+)(?=$)", cleaned_matches[i])
-            Quantity = self.extract_item_details(match, cleaned_matches, i)
-            sale_info['quantity'].append(Quantity)
-
-            match = re.search(r"(\(-\d{1,2}%\)|\(-\d{1,2}\.\d{1,2}%\))(?=$)", cleaned_matches[i])
-            Discount = self.extract_item_details(match, cleaned_matches, i)
-            Discount = Discount.strip('()') if Discount is not None else None
-            sale_info['discount'].append(Discount)
-
-            match = re.search(r"(\d{1,3}(?:,\d{2,3})*\.\d{2})(?=$)", cleaned_matches[i])
-            Cost_price = self.extract_item_details(match, cleaned_matches, i)
-            sale_info['cost_price'].append(convert_to_float(Cost_price))
-
-            match = re.search(r"(\d{1,3}(?:,\d{2,3})*\.\d{2})(?=$)", cleaned_matches[i])
-            Rate = self.extract_item_details(match, cleaned_matches, i)
-            if Rate is None:
-                Rate = Cost_price
-            sale_info['rate'].append(convert_to_float(Rate))
-
-            Item = cleaned_matches[i]
-            sale_info['items'].append(Item)
-
-
-            if has_igst:
-                sale_info['sgst_amount'].append(None)
-                sale_info['cgst_amount'].append(None)
-                sale_info['igst_amount'].append(convert_to_float(Tax_amount))
-                sale_info['sgst_rate'].append(None)
-                sale_info['cgst_rate'].append(None)
-                sale_info['igst_rate'].append(Tax_percentage)
-            else:
-                sale_info['sgst_amount'].append(convert_to_float(Tax_amount) / 2)
-                sale_info['cgst_amount'].append(convert_to_float(Tax_amount) / 2)
-                sale_info['igst_amount'].append(None)
-                sale_info['sgst_rate'].append(Tax_percentage)
-                sale_info['cgst_rate'].append(Tax_percentage)
-                sale_info['igst_rate'].append(None)
-
-            self.logger.debug(f"Amount:{Amount}")
-            self.logger.debug(f"Tax Pecentage:{Tax_percentage}")
-            self.logger.debug(f"Tax Amount:{Tax_amount}")
-            self.logger.debug(f"Taxable Value:{Taxable_value}")
-            self.logger.debug(f"Quantity:{Quantity}")
-            self.logger.debug(f"Discount:{Discount}")
-            self.logger.debug(f"Cost Price:{Cost_price}")
-            self.logger.debug(f"Rate:{Rate}")
-            self.logger.debug(f"Item:{Item}")
-            self.logger.debug(f"SGST Amount:{sale_info['sgst_amount'][i]}")
-            self.logger.debug(f"CGST Amount:{sale_info['cgst_amount'][i]}")
-            self.logger.debug(f"IGST Amount:{sale_info['igst_amount'][i]}")
-            self.logger.debug(f"SGST Rate:{sale_info['sgst_rate'][i]}")
-            self.logger.debug(f"CGST Rate:{sale_info['cgst_rate'][i]}")
-            self.logger.debug(f"IGST Rate:{sale_info['igst_rate'][i]}")
-            self.logger.debug("--------------------------")
+            self.logger.debug("%s", cleaned_matches[i])
+            Item, Rate, Cost_price, Discount, Quantity, Taxable_value, Tax_amount, Tax_percentage, Amount = template.parse_item(cleaned_matches[i])
+            sale_info.append(Item, convert_to_float(Rate), convert_to_float(Cost_price), Discount, Quantity,
+                             convert_to_float(Taxable_value), convert_to_float(Tax_amount), Tax_percentage, convert_to_float(Amount))
+
+            # Checked once per item so that nothing below is evaluated when debug logging is off
+            if debug:
+                self.logger.debug("Amount:%s", Amount)
+                self.logger.debug("Tax Pecentage:%s", Tax_percentage)
+                self.logger.debug("Tax Amount:%s", Tax_amount)
+                self.logger.debug("Taxable Value:%s", Taxable_value)
+                self.logger.debug("Quantity:%s", Quantity)
+                self.logger.debug("Discount:%s", Discount)
+                self.logger.debug("Cost Price:%s", Cost_price)
+                self.logger.debug("Rate:%s", Rate)
+                self.logger.debug("Item:%s", Item)
+                if has_igst:
+                    self.logger.debug("IGST Amount:%s", convert_to_float(Tax_amount))
+                    self.logger.debug("IGST Rate:%s", Tax_percentage)
+                else:
+                    self.logger.debug("SGST Amount:%s", convert_to_float(Tax_amount) / 2)
+                    self.logger.debug("CGST Amount:%s", convert_to_float(Tax_amount) / 2)
+                    self.logger.debug("SGST Rate:%s", Tax_percentage)
+                    self.logger.debug("CGST Rate:%s", Tax_percentage)
+                self.logger.debug("--------------------------")
 
 
 
@@ -251,5 +559,165 @@ class Extracter:
         }
 
         self.logger.info("Extracted data from list of items purchased.")
+        self.timer.add('parse', time.perf_counter() - parse_start)
 
         return sale_summary
+
+
+def process_file(file_path: Path, result_cache=None, extracter_options: dict = None):
+    """
+    Extract and score a single PDF, returns (sale_summary, accuracy, error_message, stats).
+    stats holds whether the result came from the cache, the class of every page, the name of the layout
+    template used (None for cached results), the seconds spent in every stage ('open', 'classify',
+    'extract_text', 'ocr', 'template', 'parse', 'crosscheck', 'total'...) and whether the error came from the
+    worker process dying rather than from the file (worker_died, set by iter_extract).
+    """
+    start = time.perf_counter()
+    timer = timing.StageTimer()
+    stats = {'cached': False, 'page_classes': [], 'template': None, 'stages': timer.stages, 'worker_died': False}
+    extracter_options = extracter_options or {}
+    extracter = None
+    # Every step of a file, the cache included, runs under the same error handling, so that a file that fails
+    # is reported the same way whether it was processed here, in a worker, by --watch or by the service
+    try:
+        if result_cache is not None:
+            with timer.stage('cache'):
+                # ocr_workers only changes how fast the text is found, not the result
+                cache_key = result_cache.key(file_path, {k: v for k, v in extracter_options.items() if k != 'ocr_workers'})
+                cached = result_cache.get(cache_key)
+            if cached is not None:
+                logging.info(f"Using cached result for {file_path.name}")
+                sale_summary, accuracy = cached
+                stats['cached'] = True
+                timer.add('total', time.perf_counter() - start)
+                return sale_summary, accuracy, None, stats
+
+        logging.info(f"Processing {file_path.name}")
+        extracter = Extracter(file_path=file_path, timer=timer, **extracter_options)
+        stats['page_classes'] = extracter.page_classes
+        sale_summary = extracter.extract()
+
+        # Accuracy check
+        checker = accuracy_check.Crosschecker(sale_summary=sale_summary, file_name=file_path.stem, verbose=1, timer=timer)
+        accuracy = checker.calculate_confidence_score() * 100
+
+        if result_cache is not None:
+            with timer.stage('cache'):
+                result_cache.put(cache_key, sale_summary, accuracy)
+    except ValueError as e:
+        error_message = f"Error processing {file_path.name}: {e}"
+    except RuntimeError as e:
+        error_message = f"No text found in {file_path.name}: {e}"
+    except Exception as e:
+        error_message = f"An unexpected error occurred with {file_path.name}: {e}"
+    else:
+        error_message = None
+    if extracter is not None and extracter.template is not None:
+        stats['template'] = extracter.template.name
+    timer.add('total', time.perf_counter() - start)
+    if error_message is not None:
+        logging.error(error_message)
+        return None, None, error_message, stats
+    return sale_summary, accuracy, None, stats
+
+def _worker_failed(file_path: Path, e: Exception):
+    # The worker itself died (e.g. killed by the OOM killer), report it like any other failure
+    error_message = f"An unexpected error occurred with {file_path.name}: {e!r}"
+    logging.error(error_message)
+    return file_path, None, None, error_message, {'cached': False, 'page_classes': [], 'template': None, 'stages': {}, 'worker_died': True}
+
+def _pool_result(path, future):
+    # The result of a file run in the process pool, None if the pool broke before it was done
+    if future is None or future.cancelled():
+        return None
+    try:
+        return (path, *future.result())
+    except BrokenProcessPool:
+        return None
+    except Exception as e:
+        return _worker_failed(Path(path), e)
+
+def iter_extract(paths, workers: int = 1, result_cache=None, ordered: bool = True, initializer=None, extracter_options: dict = None,
+                 with_stats: bool = False):
+    """
+    Extract and score every PDF in paths, yielding (path, sale_summary, accuracy, error) as each one completes.
+    error is None on success, otherwise sale_summary and accuracy are None.
+    With with_stats=True a fifth item is yielded, the stats dict of process_file.
+
+    With workers > 1 the files are processed in a process pool. At most a few files per worker are in
+    flight at any time so memory stays bounded however long paths is. With ordered=True the results come
+    out in the order of paths, otherwise in the order they finish.
+    A worker that dies (e.g. killed by the OOM killer) breaks the pool: the files in flight are then run again
+    one at a time in a new pool, only the file that kills its worker again is reported as failed.
+    result_cache is an optional cache.ResultCache and initializer is run once in every worker process.
+    extracter_options are passed on to Extracter (e.g. ocr_dpi, ocr_workers, ocr_mode).
+    """
+    paths = iter(paths)
+    if workers <= 1:
+        for path in paths:
+            result = (path, *process_file(Path(path), result_cache, extracter_options))
+            yield result if with_stats else result[:4]
+        return
+
+    max_in_flight = workers * 4
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=initializer)
+    in_flight = deque()
+
+    def submit_next() -> bool:
+        for path in paths:
+            try:
+                future = executor.submit(process_file, Path(path), result_cache, extracter_options)
+            except BrokenProcessPool:
+                # A worker died since the last result, the file is run again like those in flight
+                future = None
+            in_flight.append((path, future))
+            return True
+        return False
+
+    def restart() -> None:
+        nonlocal executor
+        executor.shutdown(cancel_futures=True)
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=initializer)
+
+    try:
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+
+        while in_flight:
+            if ordered:
+                path, future = in_flight.popleft()
+            else:
+                futures = [future for _, future in in_flight]
+                if None not in futures:
+                    wait(futures, return_when=FIRST_COMPLETED)
+                index = next(i for i, (_, future) in enumerate(in_flight) if future is None or future.done())
+                path, future = in_flight[index]
+                del in_flight[index]
+
+            result = _pool_result(path, future)
+            if result is not None:
+                submit_next()
+                yield result if with_stats else result[:4]
+                continue
+
+            # A worker died and took the pool down with it. The files in flight are run again one at a time
+            # in a new pool, so that only the one that kills its worker again fails, then the rest go on.
+            logging.warning(f"A worker process died, running the {len(in_flight) + 1} files in flight again one at a time")
+            suspects = [(path, future), *in_flight]
+            in_flight.clear()
+            restart()
+            for path, future in suspects:
+                result = _pool_result(path, future)
+                if result is None:
+                    try:
+                        result = (path, *executor.submit(process_file, Path(path), result_cache, extracter_options).result())
+                    except BrokenProcessPool as e:
+                        result = _worker_failed(Path(path), e)
+                        restart()
+                    except Exception as e:
+                        result = _worker_failed(Path(path), e)
+                yield result if with_stats else result[:4]
+            while len(in_flight) < max_in_flight and submit_next():
+                pass
+    finally:
+        executor.shutdown()
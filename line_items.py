@@ -0,0 +1,128 @@
+"""
+Compact line items of an invoice, the sale_info of a sale_summary.
+
+A SaleInfo reads like the sale_info dict of 15 parallel lists (sale_info['amount'], .items(), dict(sale_info)...),
+but holds its items in a few flat buffers instead of one Python object per value:
+  - the six number columns, item after item, in one array('d')
+  - the three text columns (items, discount, quantity), item after item, as UTF-8 in one bytearray with the
+    end offset of every value in an array('I')
+  - one array('H') entry per item, whose bits mark the missing (None) values
+  - the SGST/CGST/IGST amounts and rates are not stored, they follow from the tax amount, the tax percentage and has_igst
+Reading a column builds its list, so code that reads the same column often should keep the list.
+"""
+from array import array
+from collections.abc import Mapping
+
+# Keys of the sale_info dict, in order
+COLUMNS = (
+    'items', 'rate', 'cost_price', 'discount', 'quantity', 'taxable_value', 'tax_amount', 'tax_percentage', 'amount',
+    'sgst_amount', 'cgst_amount', 'igst_amount', 'sgst_rate', 'cgst_rate', 'igst_rate',
+)
+TEXT_COLUMNS = ('items', 'discount', 'quantity')
+NUMBER_COLUMNS = ('rate', 'cost_price', 'taxable_value', 'tax_amount', 'tax_percentage', 'amount')
+# Split columns: the number column they come from, whether they are the IGST ones, and whether the amount is halved
+SPLIT_COLUMNS = {
+    'sgst_amount': ('tax_amount', False, True),
+    'cgst_amount': ('tax_amount', False, True),
+    'igst_amount': ('tax_amount', True, False),
+    'sgst_rate': ('tax_percentage', False, False),
+    'cgst_rate': ('tax_percentage', False, False),
+    'igst_rate': ('tax_percentage', True, False),
+}
+_NUMBER_INDEX = {column: i for i, column in enumerate(NUMBER_COLUMNS)}
+# The missing bits of the text columns come after those of the number columns
+_TEXT_INDEX = {column: i for i, column in enumerate(TEXT_COLUMNS)}
+_TEXT_BIT = len(NUMBER_COLUMNS)
+
+
+class SaleInfo(Mapping):
+    __slots__ = ('has_igst', '_numbers', '_missing', '_text', '_text_ends')
+
+    def __init__(self, has_igst: bool = False) -> None:
+        self.has_igst = has_igst
+        self._numbers = array('d')
+        self._missing = array('H')
+        self._text = bytearray()
+        self._text_ends = array('I')
+
+    def append(self, item, rate, cost_price, discount, quantity, taxable_value, tax_amount, tax_percentage, amount) -> None:
+        # One parsed item, with its numbers already converted to float (or None)
+        missing = 0
+        for i, value in enumerate((rate, cost_price, taxable_value, tax_amount, tax_percentage, amount)):
+            if value is None:
+                missing |= 1 << i
+                value = 0.0
+            self._numbers.append(value)
+        for i, value in enumerate((item, discount, quantity), start=_TEXT_BIT):
+            if value is None:
+                missing |= 1 << i
+            else:
+                self._text += value.encode('utf-8')
+            self._text_ends.append(len(self._text))
+        self._missing.append(missing)
+
+    @property
+    def item_count(self) -> int:
+        return len(self._missing)
+
+    def floats(self, column: str):
+        """
+        A number or split column as (array('d') of its values with 0.0 for the missing ones, bytes with 1 where
+        a value is present), which NumPy reads without a copy (see aggregate.LineItems).
+        """
+        source, igst, halved = SPLIT_COLUMNS.get(column, (column, None, False))
+        index = _NUMBER_INDEX[source]
+        if igst is not None and igst != self.has_igst:
+            return array('d', bytes(8 * self.item_count)), bytes(self.item_count)
+        values = self._numbers[index::len(NUMBER_COLUMNS)]
+        if halved:
+            values = array('d', [value / 2 for value in values])
+        bit = 1 << index
+        return values, bytes(0 if missing & bit else 1 for missing in self._missing)
+
+    def _text_column(self, index: int) -> list:
+        values = []
+        bit = 1 << (_TEXT_BIT + index)
+        ends = self._text_ends
+        for item, missing in enumerate(self._missing):
+            position = item * len(TEXT_COLUMNS) + index
+            if missing & bit:
+                values.append(None)
+            else:
+                values.append(self._text[ends[position - 1] if position else 0:ends[position]].decode('utf-8'))
+        return values
+
+    def __getitem__(self, column: str) -> list:
+        if column in _TEXT_INDEX:
+            return self._text_column(_TEXT_INDEX[column])
+        source, igst, halved = SPLIT_COLUMNS.get(column, (column, None, False))
+        if source not in _NUMBER_INDEX:
+            raise KeyError(column)
+        if igst is not None and igst != self.has_igst:
+            return [None] * self.item_count
+        index = _NUMBER_INDEX[source]
+        bit = 1 << index
+        values = self._numbers[index::len(NUMBER_COLUMNS)]
+        if halved:
+            return [None if missing & bit else value / 2 for value, missing in zip(values, self._missing)]
+        return [None if missing & bit else value for value, missing in zip(values, self._missing)]
+
+    def __iter__(self):
+        return iter(COLUMNS)
+
+    def __len__(self) -> int:
+        return len(COLUMNS)
+
+    def __repr__(self) -> str:
+        return f"SaleInfo({self.item_count} items, has_igst={self.has_igst})"
+
+    def to_dict(self) -> dict:
+        # The sale_info dict of parallel lists, as written to the json files
+        return {column: self[column] for column in COLUMNS}
+
+
+def to_json(value):
+    # default= of json.dump and json.dumps, writes a SaleInfo as its dict
+    if isinstance(value, SaleInfo):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
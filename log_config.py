@@ -0,0 +1,85 @@
+import json
+import logging
+import logging.handlers
+from pathlib import Path
+
+# Every Extracter and Crosschecker logs through this one logger, the file being processed is a field of the record
+EXTRACTION_LOGGER = 'extraction'
+LOG_FILE_NAME = 'extraction.log'
+# The log file rotates at this size, keeping LOG_BACKUPS old files
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUPS = 5
+TEXT_FORMAT = '%(asctime)s - %(file_id)s - %(levelname)s - %(message)s'
+
+
+class FileIdFilter(logging.Filter):
+    # Records that are not about a file (e.g. from the main script) get '-' as their file id
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'file_id'):
+            record.file_id = '-'
+        return True
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'file_id': getattr(record, 'file_id', '-'),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class _Dispatcher(logging.Handler):
+    # Hands the records coming from the worker processes to the logger they were logged on
+    def emit(self, record: logging.LogRecord) -> None:
+        logging.getLogger(record.name).handle(record)
+
+
+def get_logger(file_id: str) -> logging.LoggerAdapter:
+    """
+    Logger for the processing of one file. Adapters are not registered anywhere, unlike named loggers,
+    so creating one per file does not grow memory over a long run.
+    """
+    return logging.LoggerAdapter(logging.getLogger(EXTRACTION_LOGGER), {'file_id': file_id})
+
+def _replace_handlers(logger: logging.Logger, handler: logging.Handler) -> None:
+    for old_handler in list(logger.handlers):
+        logger.removeHandler(old_handler)
+        old_handler.close()
+    logger.addHandler(handler)
+
+def setup_extraction_logging(log_dir: Path = Path('logs'), level: str = 'INFO', log_format: str = 'text') -> None:
+    """
+    Send the extraction logs of every file to a single rotating log file, as text lines or json lines.
+    Below level nothing is formatted, so per-item debug messages cost nothing unless --log-level DEBUG.
+    """
+    log_dir = Path(log_dir)
+    log_dir.mkdir(parents=True, exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        log_dir / LOG_FILE_NAME, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8'
+    )
+    handler.addFilter(FileIdFilter())
+    handler.setFormatter(JsonLinesFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    logger = logging.getLogger(EXTRACTION_LOGGER)
+    logger.setLevel(level)
+    # Keep the per-file logs out of the console
+    logger.propagate = False
+    _replace_handlers(logger, handler)
+
+def setup_worker_logging(queue, level: str = 'INFO') -> None:
+    # Run in every worker process: forward all records to the main process, which writes them (see start_queue_listener)
+    for name in ('', EXTRACTION_LOGGER):
+        logger = logging.getLogger(name)
+        _replace_handlers(logger, logging.handlers.QueueHandler(queue))
+    logging.getLogger().setLevel(logging.INFO)
+    extraction_logger = logging.getLogger(EXTRACTION_LOGGER)
+    extraction_logger.setLevel(level)
+    extraction_logger.propagate = False
+
+def start_queue_listener(queue) -> logging.handlers.QueueListener:
+    listener = logging.handlers.QueueListener(queue, _Dispatcher())
+    listener.start()
+    return listener
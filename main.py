@@ -1,12 +1,23 @@
 import argparse
 import extract
-import accuracy_check
-import pandas as pd
+import aggregate
+import cache
+import line_items
+import manifest
+import watch
+import ocr
+import timing
+import log_config
+import cProfile
+import functools
+import multiprocessing
+import csv
 import json
 from pathlib import Path
 from datetime import datetime
 import logging
 import sys
+import time
 
 
 def setup_logging():
@@ -18,7 +29,9 @@ def setup_logging():
         filemode='w'  # Overwrite the log file each time the script runs
     )
 
-def process_pdf_files(input_dir: Path, output_dir: Path):
+def process_pdf_files(input_dir: Path, output_dir: Path, workers: int = 1, result_cache: cache.ResultCache = None, flush_every: int = 50, resume: bool = False,
+                      extracter_options: dict = None, profile: bool = False, profile_slowest: int = 0, parquet: bool = False,
+                      file_paths: list = None, append: bool = False):
     # Create output directories if they don't exist
     sale_info_csv_dir = output_dir / 'sale_info_csv'
     sale_info_csv_dir.mkdir(parents=True, exist_ok=True)
@@ -26,85 +39,200 @@ def process_pdf_files(input_dir: Path, output_dir: Path):
     sale_info_json_dir.mkdir(parents=True, exist_ok=True)
 
     error_files = []
+    # Files whose worker process died, returned so that --watch tries them again
+    retry_paths = []
     accuracies = []
-    required_entries = []
+    page_classes = {page_class: 0 for page_class in extract.PAGE_CLASSES}
+    classify_seconds = []
+    # Files and parse seconds of every layout template, for the files extracted in this run
+    template_parse_seconds = {}
 
-    report = {
-        'error_files': error_files,
-        'accuracies': accuracies
-    }
+    # Sort so that the row order of outputs.csv and report.txt does not depend on the file system.
+    # With append (--watch) only the given files are processed, and their results are added to the
+    # existing manifest, outputs.csv and report.txt instead of replacing them.
+    if file_paths is None:
+        file_paths = sorted(input_dir.glob('*.pdf'))
 
-    # Process each PDF file in the input directory
-    for file_path in input_dir.glob('*.pdf'):
-        logging.info(f"Processing {file_path.name}")
-        extracter = extract.Extracter(file_path=file_path)
-        try:
-            sale_summary = extracter.extract()
-        except ValueError as e:
-            error_message = f"Error processing {file_path.name}: {e}"
-            logging.error(error_message)
-            error_files.append(error_message)
-            continue
-        except RuntimeError as e:
-            error_message = f"No text found in {file_path.name}: {e}"
-            logging.error(error_message)
-            error_files.append(error_message)
-            continue
-        except Exception as e:
-            error_message = f"An unexpected error occurred with {file_path.name}: {e}"
-            logging.error(error_message)
-            error_files.append(error_message)
-            continue
-
-        # Accuracy check
-        checker = accuracy_check.Crosschecker(sale_summary=sale_summary, file_name=file_path.stem, verbose=1)
-        accuracy = checker.calculate_confidence_score() * 100
-        accuracies.append((file_path.name, accuracy))
-        if accuracy < 90:
-            error_message = f"Accuracy below 90% for {file_path.name}"
-            logging.warning(error_message)
-            error_files.append(error_message)
-            continue
-
-        # Write the extracted data to JSON
-        json_output_path = sale_info_json_dir / f'{file_path.stem}.json'
-        with open(json_output_path, 'w') as f:
-            json.dump(sale_summary, f, indent=4)
-
-        # Prepare required fields for CSV output and add to the list
-        required = {
-            'taxable_value': round(sum(x for x in sale_summary['sale_info']['taxable_value'] if x is not None), 2),
-            'sgst_amount': round(sum(x for x in sale_summary['sale_info']['sgst_amount'] if x is not None), 2),
-            'cgst_amount': round(sum(x for x in sale_summary['sale_info']['cgst_amount'] if x is not None), 2),
-            'igst_amount': round(sum(x for x in sale_summary['sale_info']['igst_amount'] if x is not None), 2),
-            'sgst_rate': None,
-            'cgst_rate': None,
-            'igst_rate': None,
-            'tax_amount': round(sum(x for x in sale_summary['sale_info']['tax_amount'] if x is not None), 2),
-            'tax_rate': None,
-            'final_amount': sale_summary['total_amount'],
-            'invoice_number': sale_summary['invoice_number'],
-            'invoice_date': sale_summary['invoice_date'],
-        }
-
-        required['sgst_rate'] = round(required['sgst_amount'] / required['taxable_value'] * 100, 2)
-        required['cgst_rate'] = round(required['cgst_amount'] / required['taxable_value'] * 100, 2)
-        required['igst_rate'] = round(required['igst_amount'] / required['taxable_value'] * 100, 2)
-        required['tax_rate'] = round(required['tax_amount'] / required['final_amount'] * 100, 2)
-
-        required_entries.append(required)
-
-    # Convert the list of dictionaries to a DataFrame and write to CSV
-    if required_entries:
-        df = pd.DataFrame(required_entries)
-        csv_output_path = 'outputs.csv'
-        df.to_csv(csv_output_path, index=False, mode='w', header=not Path(csv_output_path).exists())
+    # Files finished by an earlier run are skipped when resuming, as long as they have not changed since
+    run_manifest = manifest.Manifest(output_dir / 'manifest.jsonl')
+    completed = {}
+    if resume:
+        run_manifest.load()
+        for file_path in file_paths:
+            entry = run_manifest.completed_entry(file_path)
+            json_output_path = sale_info_json_dir / f'{file_path.stem}.json'
+            if entry is not None and (entry['status'] != 'ok' or json_output_path.exists()):
+                completed[file_path] = entry
+        logging.info(f"Resuming, {len(completed)} of {len(file_paths)} files were already processed")
+    run_manifest.open(resume=resume or append)
+
+    # Worker processes send their log records through a queue, so that a single process writes the log files
+    log_listener = None
+    worker_initializer = None
+    if workers > 1:
+        log_queue = multiprocessing.Queue()
+        log_listener = log_config.start_queue_listener(log_queue)
+        extraction_level = logging.getLogger(log_config.EXTRACTION_LOGGER).getEffectiveLevel()
+        worker_initializer = functools.partial(log_config.setup_worker_logging, log_queue, extraction_level)
+
+    pending_paths = [file_path for file_path in file_paths if file_path not in completed]
+    results = extract.iter_extract(
+        pending_paths, workers=workers, result_cache=result_cache, initializer=worker_initializer,
+        extracter_options=extracter_options, with_stats=True
+    )
+
+    csv_output_path = Path('outputs.csv')
+    csv_file = None
+    csv_writer = None
+    batch = []
+
+    # Line items and invoice totals as Parquet datasets, pyarrow is only needed with --parquet
+    # With --resume and --watch the rows are added to the datasets as new parts and replace the earlier rows of
+    # their files, the files of an earlier run that already have their rows are not written again
+    parquet_sink = None
+    parquet_written = set()
+    if parquet:
+        import columnar
+        parquet_sink = columnar.ParquetSink(output_dir / 'parquet', append=resume or append)
+        if resume:
+            parquet_written = parquet_sink.written_paths()
+
+    # Per-file timings, only written out with --profile
+    run_profile = None
+    if profile:
+        run_profile = timing.RunProfile(output_dir / 'profile.jsonl', slowest=profile_slowest, append=resume or append)
+
+    def write_batch():
+        # Append the rows of the batch to outputs.csv, the file is only created once there is a row to write.
+        # The totals of the whole batch are computed at once, and the file is flushed after every batch
+        # so that the rows written so far survive a crash.
+        nonlocal csv_file, csv_writer
+        start = time.perf_counter()
+        if csv_file is None:
+            write_header = not append or not csv_output_path.exists() or csv_output_path.stat().st_size == 0
+            csv_file = open(csv_output_path, 'a' if append else 'w', newline='')
+            csv_writer = csv.DictWriter(csv_file, fieldnames=aggregate.OUTPUT_COLUMNS, lineterminator='\n')
+            if write_header:
+                csv_writer.writeheader()
+        batch_totals = aggregate.invoice_totals(sale_summary for _, sale_summary, _, _ in batch)
+        for (file_path, sale_summary, accuracy, stats), totals in zip(batch, batch_totals):
+            csv_writer.writerow(totals)
+            if parquet_sink is not None and not (stats is None and str(file_path) in parquet_written):
+                parquet_sink.write(file_path, sale_summary, accuracy, totals)
+        csv_file.flush()
+        elapsed = (time.perf_counter() - start) / len(batch)
+        for file_path, _, _, stats in batch:
+            if stats is not None:
+                stats['stages']['write_csv'] = elapsed
+                if run_profile is not None:
+                    run_profile.record(file_path, stats)
+        batch.clear()
+
+    try:
+        # Process each PDF file in the input directory, writing the outputs as soon as every file is done.
+        # Results of the earlier run are merged in at their place, so the outputs match a single full run.
+        for file_path in file_paths:
+            stats = None
+            buffered = False
+            try:
+                entry = completed.get(file_path)
+                if entry is not None:
+                    if entry['status'] == 'error':
+                        error_files.append(entry['error'])
+                        continue
+                    accuracy = entry['accuracy']
+                    accuracies.append((file_path.name, accuracy))
+                    if entry['status'] == 'low_accuracy':
+                        error_files.append(entry['error'])
+                        continue
+                    with open(sale_info_json_dir / f'{file_path.stem}.json', 'r') as f:
+                        sale_summary = json.load(f)
+                else:
+                    _, sale_summary, accuracy, error_message, stats = next(results)
+                    for page_class in stats['page_classes']:
+                        page_classes[page_class] += 1
+                    if 'classify' in stats['stages']:
+                        classify_seconds.append(stats['stages']['classify'])
+                    if stats['template'] is not None:
+                        template_parse_seconds.setdefault(stats['template'], []).append(stats['stages'].get('parse', 0.0))
+
+                    if error_message is not None:
+                        error_files.append(error_message)
+                        # A worker can die for reasons of its own (e.g. the OOM killer), --resume tries those files again
+                        run_manifest.record(file_path, 'retry' if stats['worker_died'] else 'error', error=error_message)
+                        if stats['worker_died']:
+                            retry_paths.append(file_path)
+                        continue
+
+                    accuracies.append((file_path.name, accuracy))
+                    if accuracy < 90:
+                        error_message = f"Accuracy below 90% for {file_path.name}"
+                        logging.warning(error_message)
+                        error_files.append(error_message)
+                        run_manifest.record(file_path, 'low_accuracy', accuracy=accuracy, error=error_message)
+                        continue
+
+                    # Write the extracted data to JSON
+                    start = time.perf_counter()
+                    json_output_path = sale_info_json_dir / f'{file_path.stem}.json'
+                    with open(json_output_path, 'w') as f:
+                        json.dump(sale_summary, f, indent=4, default=line_items.to_json)
+                    run_manifest.record(file_path, 'ok', accuracy=accuracy)
+                    stats['stages']['write_json'] = time.perf_counter() - start
+
+                # The row is written to outputs.csv with the rest of its batch
+                batch.append((file_path, sale_summary, accuracy, stats))
+                buffered = True
+                if len(batch) >= flush_every:
+                    write_batch()
+            finally:
+                # Only the files extracted in this run have timings, those of buffered rows are recorded with their batch
+                if run_profile is not None and stats is not None and not buffered:
+                    run_profile.record(file_path, stats)
+        if batch:
+            write_batch()
+    finally:
+        results.close()
+        if log_listener is not None:
+            log_listener.stop()
+        run_manifest.close()
+        if parquet_sink is not None:
+            parquet_sink.close()
+        if run_profile is not None:
+            run_profile.close()
+        if csv_file is not None:
+            csv_file.close()
+
+    # Keep the cache within its size and age limits, --watch only does it on the way out
+    if result_cache is not None and not append:
+        evicted = result_cache.evict()
+        if evicted:
+            logging.info(f"Evicted {evicted} entries from the result cache")
+
+    if classify_seconds:
+        # The timings are only logged so that report.txt stays the same from one run to the next
+        logging.info(f"Pages classified: {page_classes}, {sum(classify_seconds) * 1000:.1f} ms in total, "
+                     f"{sum(classify_seconds) / len(classify_seconds) * 1000:.2f} ms per file, "
+                     f"{max(classify_seconds) * 1000:.2f} ms at most")
+    for template_name, parse_seconds in template_parse_seconds.items():
+        logging.info(f"Template {template_name}: {len(parse_seconds)} files, parse p50 {timing.percentile(parse_seconds, 50) * 1000:.2f} ms, "
+                     f"p95 {timing.percentile(parse_seconds, 95) * 1000:.2f} ms, max {max(parse_seconds) * 1000:.2f} ms")
+
+    # Run the slowest files again under cProfile, so the cost of profiling is only paid for them
+    if run_profile is not None and run_profile.slowest_files():
+        profiles_dir = output_dir / 'profiles'
+        profiles_dir.mkdir(exist_ok=True)
+        for file_path in run_profile.slowest_files():
+            profiler = cProfile.Profile()
+            profiler.runcall(extract.process_file, Path(file_path), None, extracter_options)
+            profiler.dump_stats(profiles_dir / f'{Path(file_path).stem}.prof')
+        logging.info(f"Wrote cProfile dumps of the {len(run_profile.slowest_files())} slowest files to {profiles_dir}")
 
     # Log the errors and accuracies if any
     if error_files or accuracies:
         logging.info(f"Number of errors: {len(error_files)}")
         logging.info(f"Processed {len(accuracies)} files with accuracies")
-        with open("report.txt", "w") as f:
+        with open("report.txt", "a" if append else "w") as f:
             f.write(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + "\n")
             f.write("Errors:\n")
             for item in error_files:
@@ -112,24 +240,147 @@ def process_pdf_files(input_dir: Path, output_dir: Path):
             f.write("\nAccuracies:\n")
             for file_name, acc in accuracies:
                 f.write(f"{file_name}: {acc:.2f}%\n")
+            if classify_seconds:
+                f.write("\nPage classification (files extracted in this run):\n")
+                for page_class, count in page_classes.items():
+                    f.write(f"{page_class}: {count} pages\n")
+            if template_parse_seconds:
+                f.write("\nLayout templates (files extracted in this run):\n")
+                for template_name, parse_seconds in template_parse_seconds.items():
+                    f.write(f"{template_name}: {len(parse_seconds)} files\n")
+            if run_profile is not None and run_profile.per_file_stages:
+                f.write("\nProfile (files extracted in this run, see profile.jsonl in the output directory):\n")
+                for line in run_profile.report_lines():
+                    f.write(f"{line}\n")
+    return retry_paths
+
+
+def watch_pdf_files(input_dir: Path, output_dir: Path, interval: float = 5.0, rescan_every: int = 60, settle_seconds: float = 2.0,
+                    result_cache: cache.ResultCache = None, **options):
+    # Process the PDFs already in the folder that the manifest does not know, then every new or changed one
+    # as it shows up, until interrupted. Every cycle appends its files to the outputs (see process_pdf_files).
+    run_manifest = manifest.Manifest(output_dir / 'manifest.jsonl')
+    # Files recorded as 'retry' (their worker died) are not done, they are processed again
+    index = {path: (entry['size'], entry['mtime_ns']) for path, entry in run_manifest.load().items() if entry['status'] != 'retry'}
+    watcher = watch.FolderWatcher(input_dir, index, settle_seconds=settle_seconds, rescan_every=rescan_every)
+    logging.info(f"Watching {input_dir} for new PDFs every {interval}s, {len(index)} files already processed")
+    try:
+        while True:
+            file_paths = []
+            try:
+                file_paths = watcher.poll()
+                if file_paths:
+                    start = time.perf_counter()
+                    retry_paths = process_pdf_files(input_dir, output_dir, result_cache=result_cache, file_paths=file_paths,
+                                                    append=True, **options)
+                    # Those whose worker died are tried again at the next look
+                    watcher.mark([file_path for file_path in file_paths if file_path not in retry_paths])
+                    logging.info(f"Processed {len(file_paths)} new or changed files in {time.perf_counter() - start:.2f}s")
+                    if retry_paths:
+                        logging.warning(f"The worker of {len(retry_paths)} files died, they are tried again at the next look")
+            except Exception:
+                # Keep watching, the files the manifest does not have as done (retry entries included) are tried
+                # again at the next look
+                logging.exception(f"Failed to process the new files of {input_dir}")
+                if file_paths:
+                    run_manifest.load()
+                    watcher.mark([file_path for file_path in file_paths if run_manifest.completed_entry(file_path) is not None])
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logging.info("Stopped watching")
+    finally:
+        if result_cache is not None:
+            result_cache.evict()
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Process PDF files and extract data.")
     parser.add_argument('--input-dir', type=str, default='Jan to Mar', help='Directory of input PDF files.')
     parser.add_argument('--output-dir', type=str, default='extracts', help='Directory for output extracted data.')
-    return parser.parse_args()
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes used to extract the PDFs in parallel.')
+    parser.add_argument('--ocr-dpi', type=int, default=ocr.DEFAULT_DPI, help='Resolution at which scanned pages are rendered for OCR.')
+    parser.add_argument('--ocr-workers', type=int, default=1, help='Number of pages of a scanned PDF OCR\'d at the same time.')
+    parser.add_argument('--flush-every', type=int, default=50, help='Write and flush the rows of outputs.csv in batches of this many invoices.')
+    parser.add_argument('--resume', action='store_true', help='Skip the files already processed by an earlier run (see manifest.jsonl in the output directory) and merge their results.')
+    parser.add_argument('--parquet', action='store_true',
+                        help='Also write the line items and invoice totals as Parquet datasets to <output-dir>/parquet (needs pyarrow).')
+    parser.add_argument('--profile', action='store_true',
+                        help='Write the time spent in every stage of every file to profile.jsonl and p50/p95/max to report.txt.')
+    parser.add_argument('--profile-slowest', type=int, default=0,
+                        help='With --profile, run the N slowest files again under cProfile and dump their stats to <output-dir>/profiles.')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and process the PDFs added to or changed in --input-dir, appending to the outputs.')
+    parser.add_argument('--watch-interval', type=float, default=5.0, help='Seconds between two looks at the watched folder.')
+    parser.add_argument('--watch-rescan-every', type=int, default=60,
+                        help='Stat every file of the watched folder every N looks, to catch files rewritten in place (0 to never).')
+    parser.add_argument('--serve', action='store_true', help='Run the extraction service (HTTP API, see service.py) instead of processing --input-dir.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address the service listens on.')
+    parser.add_argument('--port', type=int, default=8765, help='Port the service listens on.')
+    parser.add_argument('--max-queue', type=int, default=32, help='Requests the service holds waiting for a worker, more are rejected with 503.')
+    parser.add_argument('--max-upload-mb', type=float, default=50, help='Largest PDF the service accepts as an upload, larger ones get a 413.')
+    parser.add_argument('--log-dir', type=str, default='logs', help='Directory of the extraction log (extraction.log, rotated at 50 MB).')
+    parser.add_argument('--log-level', type=str.upper, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='Level of the extraction log, DEBUG adds the details of every item.')
+    parser.add_argument('--log-format', choices=['text', 'json'], default='text', help='Write the extraction log as text or json lines.')
+    parser.add_argument('--cache-dir', type=str, default=None, help='Directory of the result cache, defaults to <output-dir>/.cache.')
+    parser.add_argument('--cache-max-entries', type=int, default=100000, help='Maximum number of results kept in the cache.')
+    parser.add_argument('--cache-max-age-days', type=float, default=180, help='Results not used for this many days are dropped from the cache.')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the result cache.')
+    parser.add_argument('--rebuild-cache', action='store_true', help='Clear the result cache and extract every file again.')
+    args = parser.parse_args()
+    if args.watch and args.serve:
+        parser.error("--watch cannot be combined with --serve")
+    return args
 
 if __name__ == '__main__':
     setup_logging()
     args = parse_args()
+    log_config.setup_extraction_logging(Path(args.log_dir), level=args.log_level, log_format=args.log_format)
     input_dir = Path(args.input_dir)
     output_dir = Path(args.output_dir)
 
-    # Check if the input directory exists
-    if not input_dir.exists() or not input_dir.is_dir():
+    # Check if the input directory exists, the service takes its PDFs from the requests
+    if not args.serve and (not input_dir.exists() or not input_dir.is_dir()):
         logging.error(f"Input directory '{input_dir}' does not exist or is not a directory.")
         sys.exit(1)
 
+    # Set up the result cache
+    result_cache = None
+    if not args.no_cache:
+        cache_dir = Path(args.cache_dir) if args.cache_dir else output_dir / '.cache'
+        result_cache = cache.ResultCache(cache_dir, max_entries=args.cache_max_entries, max_age_days=args.cache_max_age_days)
+        if args.rebuild_cache:
+            result_cache.clear()
+
+    extracter_options = {'ocr_dpi': args.ocr_dpi, 'ocr_workers': args.ocr_workers}
+    if args.serve:
+        # The service always extracts in worker processes, their log records go through a queue
+        import service
+        log_queue = multiprocessing.Queue()
+        log_listener = log_config.start_queue_listener(log_queue)
+        extraction_level = logging.getLogger(log_config.EXTRACTION_LOGGER).getEffectiveLevel()
+        extraction_service = service.ExtractionService(
+            workers=args.workers, max_queue=args.max_queue, result_cache=result_cache, extracter_options=extracter_options,
+            initializer=functools.partial(log_config.setup_worker_logging, log_queue, extraction_level),
+            max_upload_bytes=int(args.max_upload_mb * 2**20)
+        )
+        try:
+            service.serve(extraction_service, host=args.host, port=args.port)
+        finally:
+            log_listener.stop()
+        sys.exit(0)
+
+    if args.watch:
+        watch_pdf_files(
+            input_dir, output_dir, interval=args.watch_interval, rescan_every=args.watch_rescan_every, result_cache=result_cache,
+            workers=args.workers, flush_every=args.flush_every, extracter_options=extracter_options, profile=args.profile,
+            profile_slowest=args.profile_slowest, parquet=args.parquet
+        )
+        sys.exit(0)
+
     # Process the PDF files
-    process_pdf_files(input_dir, output_dir)
+    process_pdf_files(
+        input_dir, output_dir, workers=args.workers, result_cache=result_cache, flush_every=args.flush_every,
+        resume=args.resume, extracter_options=extracter_options, profile=args.profile, profile_slowest=args.profile_slowest,
+        parquet=args.parquet
+    )
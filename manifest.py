@@ -0,0 +1,74 @@
+import json
+from pathlib import Path
+
+
+class Manifest:
+    """
+    Append-only record of the files processed by a run, one json line per file with its
+    path, size, mtime, status ('ok', 'low_accuracy', 'error' or 'retry'), accuracy and error message.
+    It lets an interrupted run be resumed without processing the finished files again. 'retry' records a
+    file whose worker process died, it is not finished and is processed again.
+    """
+    def __init__(self, manifest_path: Path) -> None:
+        self.manifest_path = Path(manifest_path)
+        self.entries = {}
+        self._file = None
+
+    def load(self) -> dict:
+        # Read the entries of an earlier run, the last entry of a path wins
+        self.entries = {}
+        if not self.manifest_path.exists():
+            return self.entries
+        with open(self.manifest_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line can be cut short if the earlier run was killed while writing it
+                    continue
+                self.entries[entry['path']] = entry
+        return self.entries
+
+    def open(self, resume: bool = False) -> None:
+        # Keep the earlier entries when resuming, start a new manifest otherwise
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        if not resume:
+            self.entries = {}
+        self._file = open(self.manifest_path, 'a' if resume else 'w')
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def completed_entry(self, file_path: Path):
+        # Returns the entry of file_path if it was processed and has not changed since, otherwise None
+        entry = self.entries.get(str(file_path))
+        if entry is None or entry['status'] == 'retry':
+            return None
+        try:
+            stat = file_path.stat()
+        except OSError:
+            return None
+        if entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            return None
+        return entry
+
+    def record(self, file_path: Path, status: str, accuracy: float = None, error: str = None) -> None:
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            # Removed while it was processed, there is nothing left to resume or watch
+            return
+        entry = {
+            'path': str(file_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'status': status,
+            'accuracy': accuracy,
+            'error': error,
+        }
+        self.entries[entry['path']] = entry
+        self._file.write(json.dumps(entry) + '\n')
+        # Flush every entry so that it survives the run being killed
+        self._file.flush()
@@ -0,0 +1,214 @@
+# The OCR stack (cv2, numpy, pytesseract) is imported by the functions that use it, so that runs where every
+# page has a text layer never load it. The annotations are not evaluated, hence np.ndarray without numpy.
+from __future__ import annotations
+import os
+import re
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import timing
+
+# convert_from_path renders at 200 dpi by default, keep it so the OCR text does not change
+DEFAULT_DPI = 200
+# Pixels above this gray level become white, the rest black
+THRESHOLD = 150
+
+PGM_HEADER_PATTERN = re.compile(rb"P5\s+(\d+)\s+(\d+)\s+(\d+)\s")
+
+# Region mode: the page is first OCR'd at LOCATE_SCALE of the resolution to find the lines that hold the
+# fields Extracter.extract looks for. Those lines and the item table are then cut out at full resolution, stacked
+# into one image and OCR'd in a single tesseract run (2 tesseract runs per page).
+LOCATE_SCALE = 0.5
+# Padding in pixels around every band of rows, so that characters touching the box are not cut,
+# and white rows between two bands in the stacked image
+REGION_PADDING = 8
+REGION_GAP = 24
+# Page segmentation mode of the stacked image, a uniform block of text
+REGIONS_PSM = '--psm 6'
+HEADER_ANCHORS = ('invoice #', 'invoice date', 'due date', 'gstin')
+
+
+def preload() -> None:
+    # Import the OCR stack ahead of the first scanned page, for long-running workers (see service.py).
+    # A missing OCR dependency only fails the pages that need OCR, like in a batch run.
+    try:
+        import cv2
+        import numpy
+        import pytesseract
+    except ImportError:
+        pass
+
+def render_page(pdf_path, page_number: int, dpi: int = DEFAULT_DPI) -> np.ndarray:
+    # Rasterize a single page (1-based) straight to grayscale, pdftoppm writes it to stdout as a PGM
+    result = subprocess.run(
+        ['pdftoppm', '-f', str(page_number), '-l', str(page_number), '-r', str(dpi), '-gray', str(pdf_path)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+    )
+    return decode_pgm(result.stdout)
+
+def decode_pgm(data: bytes) -> np.ndarray:
+    match = PGM_HEADER_PATTERN.match(data)
+    if match is None:
+        raise ValueError("Rendered page is not a PGM image")
+    width, height, maxval = (int(x) for x in match.groups())
+    if maxval > 255:
+        raise ValueError("16 bit PGM images are not supported")
+    import numpy as np
+    return np.frombuffer(data, dtype=np.uint8, count=width * height, offset=match.end()).reshape(height, width)
+
+def encode_pgm(image: np.ndarray) -> bytes:
+    height, width = image.shape
+    return b"P5\n%d %d\n255\n" % (width, height) + image.tobytes()
+
+def preprocess(gray: np.ndarray) -> np.ndarray:
+    # Apply thresholding, the page is already grayscale
+    import cv2
+    _, thresh = cv2.threshold(gray, THRESHOLD, 255, cv2.THRESH_BINARY)
+    return thresh
+
+def image_to_string(image: np.ndarray, config: str = '', single_thread: bool = False) -> str:
+    # Pipe the raw PGM to tesseract instead of saving a temporary PNG like pytesseract does
+    import pytesseract
+    env = None
+    if single_thread:
+        # Pages are already OCR'd in parallel, stop every tesseract from starting its own threads too
+        env = dict(os.environ, OMP_THREAD_LIMIT='1')
+    result = subprocess.run(
+        [pytesseract.pytesseract.tesseract_cmd, 'stdin', 'stdout', *config.split()],
+        input=encode_pgm(image), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env
+    )
+    if result.returncode != 0:
+        raise pytesseract.TesseractError(result.returncode, result.stderr.decode(errors='replace'))
+    return result.stdout.decode('utf-8')
+
+def image_to_lines(image: np.ndarray, config: str = '', single_thread: bool = False):
+    """
+    Run tesseract once for its word boxes and group the words into text lines.
+    Returns a list of (left, top, right, bottom, text) in reading order.
+    """
+    tsv = image_to_string(image, config=f'{config} tsv', single_thread=single_thread)
+    lines = {}
+    for row in tsv.splitlines()[1:]:
+        fields = row.split('\t')
+        # Only the word level rows (level 5) with some text are of interest
+        if len(fields) < 12 or fields[0] != '5' or not fields[11].strip():
+            continue
+        left, top, width, height = (int(x) for x in fields[6:10])
+        key = (int(fields[1]), int(fields[2]), int(fields[3]), int(fields[4]))
+        if key not in lines:
+            lines[key] = [left, top, left + width, top + height, []]
+        line = lines[key]
+        line[0] = min(line[0], left)
+        line[1] = min(line[1], top)
+        line[2] = max(line[2], left + width)
+        line[3] = max(line[3], top + height)
+        line[4].append(fields[11])
+    return [(left, top, right, bottom, ' '.join(words)) for left, top, right, bottom, words in lines.values()]
+
+def ocr_regions(image: np.ndarray, single_thread: bool = False):
+    """
+    OCR only the parts of a preprocessed page that Extracter.extract reads: the invoice number, dates and
+    GSTIN lines, the place of supply, the item table and the tax and total lines.
+    They are located by a tesseract run at LOCATE_SCALE, then OCR'd at full resolution in a single tesseract run
+    over full-width bands of the page stacked in page order.
+    Returns the text laid out like a full page OCR, or None if the item table could not be located.
+    """
+    import cv2
+    import numpy as np
+    small = cv2.resize(image, None, fx=LOCATE_SCALE, fy=LOCATE_SCALE, interpolation=cv2.INTER_AREA)
+    scale = 1 / LOCATE_SCALE
+    lines = [(int(left * scale), int(top * scale), int(right * scale), int(bottom * scale), text)
+             for left, top, right, bottom, text in image_to_lines(small, single_thread=single_thread)]
+
+    table_header = None
+    table_footer = None
+    for i, (_, _, _, _, text) in enumerate(lines):
+        lowered = text.lower()
+        if table_header is None and 'qty' in lowered and 'amount' in lowered:
+            table_header = i
+        elif table_header is not None and table_footer is None and 'taxable amount' in lowered:
+            table_footer = i
+    if table_header is None or table_footer is None:
+        return None
+
+    # Rows to OCR as (top, bottom): the header field lines, the item table from its header down to the
+    # "Taxable Amount" line, and the tax and total lines below it
+    bands = []
+    after_place_of_supply = False
+    for _, top, _, bottom, text in lines[:table_header]:
+        lowered = text.lower()
+        # The state code is usually on the line after the place of supply
+        if after_place_of_supply or 'place of supply' in lowered or any(anchor in lowered for anchor in HEADER_ANCHORS):
+            bands.append((top, bottom))
+        after_place_of_supply = 'place of supply' in lowered
+    bands.append((lines[table_header][1], lines[table_footer][3]))
+    for _, top, _, bottom, text in lines[table_footer + 1:]:
+        lowered = text.lower()
+        if lowered.startswith('total') or 'gst' in lowered:
+            bands.append((top, bottom))
+
+    height, width = image.shape
+    merged = []
+    for top, bottom in sorted(bands):
+        top, bottom = max(top - REGION_PADDING, 0), min(bottom + REGION_PADDING, height)
+        if merged and top <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], bottom)
+        else:
+            merged.append([top, bottom])
+    gap = np.full((REGION_GAP, width), 255, dtype=image.dtype)
+    stacked = []
+    for top, bottom in merged:
+        if stacked:
+            stacked.append(gap)
+        stacked.append(image[top:bottom])
+    return image_to_string(np.vstack(stacked), config=REGIONS_PSM, single_thread=single_thread)
+
+def ocr_page(pdf_path, page_number: int, dpi: int = DEFAULT_DPI, single_thread: bool = False, mode: str = 'page',
+             timer: timing.StageTimer = None) -> str:
+    with timing.stage(timer, 'render'):
+        gray = render_page(pdf_path, page_number, dpi)
+    with timing.stage(timer, 'preprocess'):
+        image = preprocess(gray)
+    with timing.stage(timer, 'tesseract'):
+        if mode == 'regions':
+            text = ocr_regions(image, single_thread=single_thread)
+            if text is not None:
+                return text
+            # The layout was not recognised, fall back to the whole page
+        return image_to_string(image, single_thread=single_thread)
+
+def iter_ocr_pages(pdf_path, page_count: int, dpi: int = DEFAULT_DPI, workers: int = 1, mode: str = 'page',
+                   timer: timing.StageTimer = None):
+    """
+    OCR the pages of a PDF and yield their text in page order.
+    Every page is rendered, thresholded and OCR'd on its own, so only the pages in flight are held in memory.
+    With workers > 1 up to that many pages are processed at the same time, rendering and OCR run
+    in subprocesses so threads are enough.
+    mode is 'page' to OCR the whole page or 'regions' to only OCR the fields Extracter.extract reads.
+    The time spent rendering, preprocessing and in tesseract is added to timer if one is given.
+    """
+    if workers <= 1:
+        for page_number in range(1, page_count + 1):
+            yield ocr_page(pdf_path, page_number, dpi, mode=mode, timer=timer)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        page_numbers = iter(range(1, page_count + 1))
+        for page_number in page_numbers:
+            in_flight.append(executor.submit(ocr_page, pdf_path, page_number, dpi, True, mode, timer))
+            if len(in_flight) >= workers:
+                break
+        while in_flight:
+            text = in_flight.popleft().result()
+            for page_number in page_numbers:
+                in_flight.append(executor.submit(ocr_page, pdf_path, page_number, dpi, True, mode, timer))
+                break
+            yield text
+
+def ocr_pdf(pdf_path, page_count: int, dpi: int = DEFAULT_DPI, workers: int = 1, mode: str = 'page',
+            timer: timing.StageTimer = None) -> str:
+    extracted_text = ""
+    for text in iter_ocr_pages(pdf_path, page_count, dpi, workers, mode, timer):
+        extracted_text += text + "\n"
+    return extracted_text
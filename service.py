@@ -0,0 +1,329 @@
+"""
+Long-running extraction service (main.py --serve).
+
+A pool of worker processes is started once and kept warm, requests are PDF paths or the bytes of a PDF,
+and every response is the sale_summary with its accuracy, exactly as main.py gets them from process_file.
+At most workers + max_queue requests are accepted at a time, the ones beyond that are rejected right
+away (HTTP 503) so that callers back off instead of piling up. Uploads larger than max_upload_bytes are
+rejected with HTTP 413.
+A worker that dies (e.g. killed by the OOM killer) breaks the pool: it is replaced by a new warm one, and the
+requests that were in flight are tried once more in it, so only a request that kills its worker again fails.
+
+Endpoints:
+    POST /extract   {"path": "/path/to/invoice.pdf"}, or the PDF itself with Content-Type: application/pdf
+                    and an optional ?name=invoice.pdf
+    GET  /health    whether the service accepts requests
+    GET  /metrics   request counts, latencies, the seconds spent in every stage and the files of every layout template
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs, quote
+import json
+import logging
+import functools
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import extract
+import line_items
+import ocr
+import timing
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_MAX_UPLOAD_BYTES = 50 * 2**20
+# Latencies kept for the percentiles of /metrics
+LATENCY_WINDOW = 1000
+
+
+class ServiceBusy(Exception):
+    """Raised when the service already holds as many requests as it accepts."""
+
+
+class ServiceClosed(Exception):
+    """Raised when the service has been closed and takes no more requests."""
+
+
+class UploadTooLarge(Exception):
+    """Raised when an uploaded PDF is larger than the service accepts."""
+
+
+def _init_worker(initializer=None) -> None:
+    # Ctrl-C reaches the whole process group, only the main process handles it and shuts the workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer()
+
+def _warm_up() -> int:
+    # Run once in every worker so that the processes exist, with the OCR stack loaded, before the first request
+    ocr.preload()
+    return os.getpid()
+
+
+class ExtractionService:
+    def __init__(self, workers: int = 2, max_queue: int = DEFAULT_MAX_QUEUE, result_cache=None, extracter_options: dict = None,
+                 initializer=None, max_upload_bytes: int = DEFAULT_MAX_UPLOAD_BYTES) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_upload_bytes = max_upload_bytes
+        self.result_cache = result_cache
+        self.extracter_options = extracter_options
+        # Requests being extracted or waiting for a worker, bounded by workers + max_queue
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._initializer = functools.partial(_init_worker, initializer)
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=self._initializer)
+        # Pools replaced after a worker died
+        self.pool_restarts = 0
+        # PDFs sent as bytes are written here for the workers to read, and deleted once extracted
+        self._upload_dir = Path(tempfile.mkdtemp(prefix='invoice-service-'))
+        self._closed = False
+        self.started = time.time()
+        self.counts = {'accepted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'in_flight': 0}
+        self.stages = {}
+        # Files extracted with every layout template
+        self.templates = {}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def start(self) -> None:
+        # Start every worker process now, so that no request pays for it
+        for future in [self._executor.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+        logging.info(f"Extraction service started with {self.workers} workers")
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(self._upload_dir, ignore_errors=True)
+
+    def _replace_pool(self, broken: ProcessPoolExecutor) -> None:
+        # Replace a pool broken by a dead worker, once however many requests saw it break
+        with self._lock:
+            if self._closed or self._executor is not broken:
+                return
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=self._initializer)
+            # Start the new workers right away, the requests queue behind their warm-up
+            for _ in range(self.workers):
+                self._executor.submit(_warm_up)
+            self.pool_restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+        logging.warning("A worker process died, the pool was replaced")
+
+    def _process(self, file_path: Path) -> tuple:
+        # process_file in the pool, tried once more in a new pool if the pool broke, since the request may only have
+        # been in flight next to the one that killed its worker
+        for attempt in range(2):
+            executor = self._executor
+            try:
+                return executor.submit(extract.process_file, file_path, self.result_cache, self.extracter_options).result()
+            except BrokenProcessPool:
+                self._replace_pool(executor)
+                if attempt:
+                    raise
+
+    def extract(self, path: str = None, data: bytes = None, name: str = None) -> dict:
+        """
+        Extract and score one PDF, given its path or its bytes (name is then used in the logs and error messages).
+        Returns {'file', 'sale_summary', 'accuracy', 'error', 'cached', 'seconds'}, error is None on success.
+        Raises ServiceBusy if the service is full, ServiceClosed once it is closed, UploadTooLarge if data is larger
+        than max_upload_bytes, and ValueError if neither path nor data is given or the path is not a readable file.
+        """
+        if (path is None) == (data is None):
+            raise ValueError("Give either the path or the bytes of a PDF")
+        if path is not None and not (os.path.isfile(path) and os.access(path, os.R_OK)):
+            raise ValueError(f"No readable file at {path}")
+        if data is not None and len(data) > self.max_upload_bytes:
+            raise UploadTooLarge(f"Uploads are limited to {self.max_upload_bytes} bytes")
+        if self._closed:
+            raise ServiceClosed("The service is closed")
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.counts['rejected'] += 1
+            raise ServiceBusy(f"The service is holding {self.workers + self.max_queue} requests already")
+
+        start = time.perf_counter()
+        # Only the last part of an uploaded name is kept, so that the upload stays in its own directory
+        file_name = Path(path).name if path is not None else (Path(name).name if name else '') or 'upload.pdf'
+        upload_dir = None
+        sale_summary, accuracy, error_message, stats = None, None, None, {}
+        with self._lock:
+            self.counts['accepted'] += 1
+            self.counts['in_flight'] += 1
+        try:
+            if data is not None:
+                # Every upload gets its own directory so that its file keeps the given name
+                upload_dir = Path(tempfile.mkdtemp(dir=self._upload_dir))
+                file_path = upload_dir / file_name
+                file_path.write_bytes(data)
+            else:
+                file_path = Path(path)
+            sale_summary, accuracy, error_message, stats = self._process(file_path)
+        except BrokenProcessPool as e:
+            # The worker died again in the new pool, only this request fails
+            error_message = f"An unexpected error occurred with {file_name}: {e!r}"
+            logging.error(error_message)
+        except Exception as e:
+            error_message = f"An unexpected error occurred with {file_name}: {e!r}"
+            logging.error(error_message)
+        finally:
+            if upload_dir is not None:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+            self._slots.release()
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.counts['in_flight'] -= 1
+                self.counts['completed' if error_message is None else 'failed'] += 1
+                self.latencies.append(seconds)
+                for stage, stage_seconds in stats.get('stages', {}).items():
+                    self.stages[stage] = self.stages.get(stage, 0.0) + stage_seconds
+                if stats.get('template') is not None:
+                    self.templates[stats['template']] = self.templates.get(stats['template'], 0) + 1
+        return {
+            'file': file_name,
+            'sale_summary': sale_summary,
+            'accuracy': accuracy,
+            'error': error_message,
+            'cached': stats.get('cached', False),
+            'seconds': seconds,
+        }
+
+    def health(self) -> dict:
+        with self._lock:
+            in_flight = self.counts['in_flight']
+        return {
+            'status': 'closed' if self._closed else 'ok',
+            'workers': self.workers,
+            'in_flight': in_flight,
+            'capacity': self.workers + self.max_queue,
+        }
+
+    def metrics(self) -> dict:
+        with self._lock:
+            latencies = list(self.latencies)
+            metrics = {
+                'uptime_seconds': time.time() - self.started,
+                'requests': dict(self.counts),
+                'pool_restarts': self.pool_restarts,
+                'stage_seconds': dict(self.stages),
+                'templates': dict(self.templates),
+            }
+        if latencies:
+            metrics['latency_seconds'] = {
+                'p50': timing.percentile(latencies, 50),
+                'p95': timing.percentile(latencies, 95),
+                'max': max(latencies),
+            }
+        return metrics
+
+    def handle(self, method: str, url: str, body: bytes = b'', content_type: str = '') -> tuple:
+        """
+        Route one API request, returns (HTTP status, JSON payload).
+        Shared by the HTTP server and LocalClient, so that both behave the same.
+        """
+        route = urlsplit(url)
+        if method == 'GET' and route.path == '/health':
+            health = self.health()
+            return (200 if health['status'] == 'ok' else 503), health
+        if method == 'GET' and route.path == '/metrics':
+            return 200, self.metrics()
+        if method == 'POST' and route.path == '/extract':
+            try:
+                if content_type.split(';')[0].strip() == 'application/pdf':
+                    name = parse_qs(route.query).get('name', [None])[0]
+                    return 200, self.extract(data=body, name=name)
+                request = json.loads(body or b'{}')
+                if not isinstance(request, dict) or not isinstance(request.get('path'), str):
+                    return 400, {'error': "Expected a JSON object with the path of a PDF"}
+                return 200, self.extract(path=request['path'])
+            except (ServiceBusy, ServiceClosed) as e:
+                return 503, {'error': str(e)}
+            except UploadTooLarge as e:
+                return 413, {'error': str(e)}
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            except Exception as e:
+                logging.exception("Request failed")
+                return 500, {'error': f"{e!r}"}
+        return 404, {'error': f"No such endpoint: {method} {route.path}"}
+
+
+class LocalClient:
+    """
+    In-process client of an ExtractionService, for tests and scripts that run in the same process.
+    Requests go through the same routing as HTTP ones, every method returns (status, payload).
+    """
+    def __init__(self, service: ExtractionService) -> None:
+        self.service = service
+
+    def extract(self, path: str = None, data: bytes = None, name: str = None) -> tuple:
+        if data is not None:
+            url = '/extract' if name is None else f"/extract?name={quote(name, safe='')}"
+            return self.service.handle('POST', url, data, 'application/pdf')
+        return self.service.handle('POST', '/extract', json.dumps({'path': str(path)}).encode(), 'application/json')
+
+    def health(self) -> tuple:
+        return self.service.handle('GET', '/health')
+
+    def metrics(self) -> tuple:
+        return self.service.handle('GET', '/metrics')
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # Set on the subclass made by serve
+    service = None
+
+    def _respond(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, default=line_items.to_json).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        self._respond(*self.service.handle('GET', self.path))
+
+    def do_POST(self) -> None:
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > self.service.max_upload_bytes:
+            # The body is not read, the connection cannot be reused
+            self.close_connection = True
+            if length < 0:
+                self._respond(400, {'error': "Invalid Content-Length"})
+            else:
+                self._respond(413, {'error': f"Uploads are limited to {self.service.max_upload_bytes} bytes"})
+            return
+        body = self.rfile.read(length)
+        self._respond(*self.service.handle('POST', self.path, body, self.headers.get('Content-Type', '')))
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+def serve(service: ExtractionService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+    # Serve the HTTP API until interrupted, the service is closed on the way out
+    handler = type('RequestHandler', (_RequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    service.start()
+    logging.info(f"Serving the extraction API on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Stopping the extraction service")
+    finally:
+        server.server_close()
+        service.close()
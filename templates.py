@@ -0,0 +1,76 @@
+import re
+
+
+class Template:
+    """
+    An invoice layout: the anchor strings that identify it, the patterns of its header fields (each with
+    the value as group 1), the strings around its item table and the parser of one item line.
+    fields holds invoice_number, invoice_date, due_date, gstin, total_amount and place_of_supply,
+    igst_pattern decides whether the taxes are IGST or split into SGST and CGST.
+    item_split_pattern finds the items of the table, item_prefix_pattern (or None) matches what comes before
+    the item name at the start of every item, e.g. its serial number, and is dropped.
+    item_line_end_pattern matches the lines that can end an item, on a page the table runs past the lines
+    after the last of them are the page footer.
+    """
+    def __init__(self, name: str, anchors, fields: dict, table_start: str, table_end: str, parse_item, igst_pattern,
+                 item_split_pattern, item_prefix_pattern, item_line_end_pattern) -> None:
+        self.name = name
+        self.anchors = tuple(anchors)
+        self.fields = dict(fields)
+        self.table_start = table_start
+        self.table_end = table_end
+        self.parse_item = parse_item
+        self.igst_pattern = igst_pattern
+        self.item_split_pattern = item_split_pattern
+        self.item_prefix_pattern = item_prefix_pattern
+        self.item_line_end_pattern = item_line_end_pattern
+        # The item table of a single page, everything between the end of table_start and the next table_end
+        self.items_pattern = re.compile(f"(?<={re.escape(table_start)})(.*?){re.escape(table_end)}", re.DOTALL)
+
+
+class TemplateIndex:
+    """
+    Picks the template of a page in a single pass over its text: the anchors of all the templates are
+    compiled into one alternation (longest first), and the template with the most of its own anchors
+    found wins, the earliest registered one on a tie. Without any anchor found, the first template is used.
+    An anchor that only occurs inside a longer anchor of another template is not seen.
+    """
+    def __init__(self, templates) -> None:
+        self.templates = list(templates)
+        self._templates_of = {}
+        for position, template in enumerate(self.templates):
+            for anchor in template.anchors:
+                self._templates_of.setdefault(anchor, []).append(position)
+        anchors = sorted(self._templates_of, key=len, reverse=True)
+        self._pattern = re.compile('|'.join(re.escape(anchor) for anchor in anchors)) if anchors else None
+
+    def match(self, page_text: str):
+        # Returns (template, number of its anchors found)
+        if self._pattern is None:
+            return self.templates[0], 0
+        found = {match.group() for match in self._pattern.finditer(page_text)}
+        hits = [0] * len(self.templates)
+        for anchor in found:
+            for position in self._templates_of[anchor]:
+                hits[position] += 1
+        best = max(range(len(self.templates)), key=lambda position: (hits[position], -position))
+        return self.templates[best], hits[best]
+
+
+# Templates in order of registration, the first one is the default layout (see extract.DEFAULT_TEMPLATE)
+TEMPLATES = []
+_index = None
+
+def register(template: Template) -> None:
+    global _index
+    if any(registered.name == template.name for registered in TEMPLATES):
+        raise ValueError(f"A template named {template.name} is already registered")
+    TEMPLATES.append(template)
+    _index = None
+
+def index() -> TemplateIndex:
+    # The index of the registered templates, rebuilt after a registration
+    global _index
+    if _index is None:
+        _index = TemplateIndex(TEMPLATES)
+    return _index
@@ -0,0 +1,34 @@
+import functools
+import os
+import sys
+import unittest
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+import extract
+
+
+def exit_on(file_name):
+    # Worker initializer: the worker process dies as soon as it is given file_name
+    process_file = extract.process_file
+    def process_or_exit(file_path, *args, **kwargs):
+        if file_path.name == file_name:
+            os._exit(1)
+        return process_file(file_path, *args, **kwargs)
+    extract.process_file = process_or_exit
+
+
+class IterExtractTest(unittest.TestCase):
+    def test_crashing_worker_only_fails_its_file(self):
+        pdf_paths = sorted((REPO_DIR / 'Jan to Mar').glob('*.pdf'))
+        crashing = pdf_paths[3]
+        results = list(extract.iter_extract(pdf_paths, workers=2, initializer=functools.partial(exit_on, crashing.name)))
+        self.assertEqual([path for path, _, _, _ in results], pdf_paths)
+        failed = [path for path, _, _, error in results if error is not None]
+        self.assertEqual(failed, [crashing])
+        self.assertIn('BrokenProcessPool', results[3][3])
+
+
+if __name__ == '__main__':
+    unittest.main()
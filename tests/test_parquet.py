@@ -0,0 +1,73 @@
+import functools
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+import main
+import manifest
+
+try:
+    import columnar
+    import pyarrow.parquet as pq
+except ImportError:
+    columnar = None
+
+
+@unittest.skipIf(columnar is None, "needs pyarrow")
+class ResumeParquetTest(unittest.TestCase):
+    def setUp(self):
+        # process_pdf_files writes outputs.csv and report.txt to the working directory
+        self.work_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.work_dir)
+        self.input_dir = self.work_dir / 'input'
+        self.input_dir.mkdir()
+        for pdf_path in sorted((REPO_DIR / 'Jan to Mar').glob('*.pdf'))[:12]:
+            shutil.copy(pdf_path, self.input_dir)
+        self.output_dir = self.work_dir / 'extracts'
+        self.parquet_dir = self.output_dir / 'parquet'
+
+    def rows_per_path(self, dataset: str) -> dict:
+        counts = {}
+        for path in pq.read_table(self.parquet_dir / dataset, columns=['path']).column('path').to_pylist():
+            counts[path] = counts.get(path, 0) + 1
+        return counts
+
+    def test_resume_after_crash_writes_every_file_once(self):
+        # Small parts, so that the killed run leaves some behind
+        sink_class = columnar.ParquetSink
+        small_parts = functools.partial(sink_class, row_group_size=5)
+        with mock.patch.object(columnar, 'ParquetSink', small_parts):
+            main.process_pdf_files(self.input_dir, self.output_dir, parquet=True)
+            line_items = self.rows_per_path('line_items')
+
+            # A second full run is killed after 8 files: its sink is never closed and its manifest stops there
+            record = manifest.Manifest.record
+            def record_then_die(recorder, file_path, *args, **kwargs):
+                if len(recorder.entries) == 8:
+                    raise KeyboardInterrupt
+                record(recorder, file_path, *args, **kwargs)
+            with mock.patch.object(manifest.Manifest, 'record', record_then_die), \
+                    mock.patch.object(sink_class, 'close', lambda sink: None):
+                with self.assertRaises(KeyboardInterrupt):
+                    main.process_pdf_files(self.input_dir, self.output_dir, parquet=True, flush_every=2)
+            self.assertTrue(any(self.parquet_dir.glob(f'*/{columnar.STAGING_PREFIX}*/*.parquet')))
+
+            main.process_pdf_files(self.input_dir, self.output_dir, resume=True, parquet=True)
+
+        invoices = self.rows_per_path('invoices')
+        self.assertEqual(set(invoices), {str(path) for path in self.input_dir.glob('*.pdf')})
+        self.assertEqual(set(invoices.values()), {1})
+        self.assertEqual(self.rows_per_path('line_items'), line_items)
+        self.assertFalse(any(self.parquet_dir.glob(f'*/{columnar.STAGING_PREFIX}*')))
+
+
+if __name__ == '__main__':
+    unittest.main()
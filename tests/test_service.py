@@ -0,0 +1,92 @@
+import functools
+import os
+import sys
+import unittest
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+import extract
+import service
+
+
+def exit_on(file_name):
+    # Worker initializer: the worker process dies as soon as it is given file_name
+    process_file = extract.process_file
+    def process_or_exit(file_path, *args, **kwargs):
+        if file_path.name == file_name:
+            os._exit(1)
+        return process_file(file_path, *args, **kwargs)
+    extract.process_file = process_or_exit
+
+
+class LocalClientTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.extraction_service = service.ExtractionService(workers=1, max_queue=2)
+        cls.extraction_service.start()
+        cls.client = service.LocalClient(cls.extraction_service)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.extraction_service.close()
+
+    def test_extract_path(self):
+        pdf_path = sorted((REPO_DIR / 'Jan to Mar').glob('*.pdf'))[0]
+        status, payload = self.client.extract(path=pdf_path)
+        self.assertEqual(status, 200)
+        self.assertIsNone(payload['error'])
+        self.assertEqual(payload['file'], pdf_path.name)
+        self.assertGreaterEqual(payload['accuracy'], 90)
+
+    def test_bad_requests_are_answered_and_released(self):
+        status, payload = self.client.extract(path='/nonexistent.pdf')
+        self.assertEqual(status, 400)
+        self.assertIn('/nonexistent.pdf', payload['error'])
+        status, payload = self.client.extract(data=b'not a pdf', name='/')
+        self.assertEqual(status, 200)
+        self.assertIsNotNone(payload['error'])
+        status, health = self.client.health()
+        self.assertEqual(status, 200)
+        self.assertEqual(health['in_flight'], 0)
+        status, metrics = self.client.metrics()
+        self.assertEqual(metrics['requests']['in_flight'], 0)
+
+    def test_upload_name_is_quoted(self):
+        status, payload = self.client.extract(data=b'not a pdf', name='a&b #1 100%.pdf')
+        self.assertEqual(status, 200)
+        self.assertEqual(payload['file'], 'a&b #1 100%.pdf')
+
+    def test_upload_too_large(self):
+        status, payload = self.client.extract(data=b'x' * (self.extraction_service.max_upload_bytes + 1))
+        self.assertEqual(status, 413)
+
+
+class WorkerCrashTest(unittest.TestCase):
+    def test_service_survives_a_dead_worker(self):
+        pdf_paths = sorted((REPO_DIR / 'Jan to Mar').glob('*.pdf'))
+        extraction_service = service.ExtractionService(
+            workers=1, max_queue=2, initializer=functools.partial(exit_on, pdf_paths[0].name)
+        )
+        extraction_service.start()
+        client = service.LocalClient(extraction_service)
+        try:
+            status, payload = client.extract(path=pdf_paths[0])
+            self.assertEqual(status, 200)
+            self.assertIn('BrokenProcessPool', payload['error'])
+            status, health = client.health()
+            self.assertEqual((status, health['status']), (200, 'ok'))
+            status, payload = client.extract(path=pdf_paths[1])
+            self.assertEqual(status, 200)
+            self.assertIsNone(payload['error'])
+            status, metrics = client.metrics()
+            self.assertEqual(metrics['pool_restarts'], 2)
+        finally:
+            extraction_service.close()
+        status, payload = client.extract(path=pdf_paths[1])
+        self.assertEqual(status, 503)
+        self.assertEqual(payload['error'], "The service is closed")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import heapq
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class StageTimer:
+    """
+    Accumulates the wall-clock seconds spent in named stages of the processing of one file.
+    It only costs a couple of perf_counter calls per stage, so it is always on.
+    Safe to share between the threads that OCR the pages of a file.
+    """
+    def __init__(self) -> None:
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+def stage(timer: StageTimer, name: str):
+    # Time a stage if there is a timer, do nothing otherwise
+    if timer is None:
+        return nullcontext()
+    return timer.stage(name)
+
+def percentile(values, q: float) -> float:
+    # Nearest-rank percentile, q between 0 and 100
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+def summarize(per_file_stages) -> dict:
+    # p50/p95/max of every stage over the files that went through it
+    values = {}
+    for stages in per_file_stages:
+        for name, seconds in stages.items():
+            values.setdefault(name, []).append(seconds)
+    return {
+        name: {
+            'files': len(seconds),
+            'total': sum(seconds),
+            'p50': percentile(seconds, 50),
+            'p95': percentile(seconds, 95),
+            'max': max(seconds),
+        }
+        for name, seconds in values.items()
+    }
+
+
+class RunProfile:
+    """
+    Per-file timings of a run for --profile: every file's stages are written as one json line to
+    profile_path as soon as it is done, and kept for the p50/p95/max aggregates of report.txt.
+    The slowest files are remembered so that they can be run again under cProfile.
+    """
+    # Order of the stages in the report, any other stage comes after them
+    STAGE_ORDER = ['total', 'cache', 'open', 'classify', 'extract_text', 'ocr', 'render', 'preprocess', 'tesseract',
+                   'template', 'parse', 'crosscheck', 'write_json', 'write_csv']
+
+    def __init__(self, profile_path, slowest: int = 0, append: bool = False) -> None:
+        self._file = open(profile_path, 'a' if append else 'w')
+        self.slowest = slowest
+        self.per_file_stages = []
+        self._slowest_heap = []
+
+    def record(self, file_path, stats: dict) -> None:
+        stages = {name: round(seconds, 6) for name, seconds in stats['stages'].items()}
+        self.per_file_stages.append(stages)
+        self._file.write(json.dumps({
+            'file': str(file_path),
+            'cached': stats['cached'],
+            'page_classes': stats['page_classes'],
+            'stages': stages,
+        }) + '\n')
+        self._file.flush()
+
+        # Keep the slowest files in a min-heap of size slowest
+        if self.slowest > 0 and not stats['cached']:
+            item = (stages.get('total', 0.0), str(file_path))
+            if len(self._slowest_heap) < self.slowest:
+                heapq.heappush(self._slowest_heap, item)
+            else:
+                heapq.heappushpop(self._slowest_heap, item)
+
+    def slowest_files(self):
+        return [file_path for _, file_path in sorted(self._slowest_heap, reverse=True)]
+
+    def report_lines(self):
+        summary = summarize(self.per_file_stages)
+        names = [name for name in self.STAGE_ORDER if name in summary]
+        names += sorted(name for name in summary if name not in self.STAGE_ORDER)
+        lines = []
+        for name in names:
+            values = summary[name]
+            lines.append(f"{name}: p50 {values['p50'] * 1000:.2f} ms, p95 {values['p95'] * 1000:.2f} ms, "
+                         f"max {values['max'] * 1000:.2f} ms, total {values['total']:.3f} s over {values['files']} files")
+        return lines
+
+    def close(self) -> None:
+        self._file.close()
@@ -0,0 +1,85 @@
+import os
+import time
+from pathlib import Path
+
+
+class FolderWatcher:
+    """
+    Polls a folder for new and changed PDFs (main.py --watch).
+
+    index maps the path of every processed file to its (size, mtime_ns), as recorded in the manifest.
+    A poll stats the folder itself, and only lists it when its mtime changed, i.e. when files were added,
+    removed or replaced. Only the names that are new or now point to another inode are then stat'ed, so
+    a poll costs the number of new files and not the size of the folder.
+    A file rewritten in place does not change the folder, every rescan_every polls all the files are
+    stat'ed to catch those (0 to never do it).
+    A file is only returned once it has not been written to for settle_seconds, so that a PDF still
+    being copied is not read half way.
+    A returned file is returned again by every poll until it is marked as processed with mark().
+    """
+    def __init__(self, input_dir: Path, index: dict = None, settle_seconds: float = 2.0, rescan_every: int = 60) -> None:
+        self.input_dir = Path(input_dir)
+        self.index = dict(index or {})
+        self.settle_seconds = settle_seconds
+        self.rescan_every = rescan_every
+        self.polls = 0
+        self._folder_mtime = None
+        # Inode of every PDF in the folder at the last listing, and the names to look at again
+        self._inodes = {}
+        self._pending = set()
+        # (size, mtime_ns) of the returned files, added to the index once they are marked
+        self._ready = {}
+
+    def _list(self, rescan: bool) -> None:
+        inodes = {}
+        with os.scandir(self.input_dir) as entries:
+            for entry in entries:
+                # Same files as input_dir.glob('*.pdf')
+                if entry.name.endswith('.pdf') and not entry.name.startswith('.'):
+                    inodes[entry.name] = entry.inode()
+        if rescan:
+            self._pending.update(inodes)
+        else:
+            self._pending.update(name for name, inode in inodes.items() if self._inodes.get(name) != inode)
+        self._pending.intersection_update(inodes)
+        self._inodes = inodes
+
+    def poll(self) -> list:
+        """
+        Returns the sorted paths of the PDFs that are new or changed since they were processed.
+        """
+        rescan = self.rescan_every > 0 and self.polls % self.rescan_every == 0
+        self.polls += 1
+        folder_mtime = os.stat(self.input_dir).st_mtime_ns
+        if rescan or folder_mtime != self._folder_mtime:
+            self._folder_mtime = folder_mtime
+            self._list(rescan)
+
+        now = time.time()
+        ready = []
+        for name in list(self._pending):
+            file_path = self.input_dir / name
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                self._pending.discard(name)
+                self._ready.pop(str(file_path), None)
+                continue
+            if self.index.get(str(file_path)) == (stat.st_size, stat.st_mtime_ns):
+                self._pending.discard(name)
+                continue
+            if now - stat.st_mtime < self.settle_seconds:
+                # Still being written, look again at the next poll
+                continue
+            self._ready[str(file_path)] = (stat.st_size, stat.st_mtime_ns)
+            ready.append(file_path)
+        return sorted(ready)
+
+    def mark(self, file_paths) -> None:
+        # Adds processed files to the index, with the size and mtime they had when they were returned.
+        # A file changed since then is different from its index entry, and is returned again once it is seen.
+        for file_path in file_paths:
+            stat = self._ready.pop(str(file_path), None)
+            if stat is not None:
+                self.index[str(file_path)] = stat
+                self._pending.discard(Path(file_path).name)